@@ -1,5 +1,7 @@
 import pandas as pd
 
+from normalize_race_data import normalize_race_results, summarize_flags
+
 # 1. ファイル名を定義します
 # 読み込む元のファイル
 input_filename = 'all_horses_race_data_appended.csv'
@@ -8,26 +10,28 @@ output_filename = 'cleaned_race_data.csv'
 
 try:
     # 2. 元のCSVファイルを読み込みます
+    # "中"（競走中止）や "---"（オッズなし）などの記号を残すため、全ての列を文字列のまま読み込みます
     print(f"元のファイル '{input_filename}' を読み込んでいます...")
-    df = pd.read_csv(input_filename)
+    df = pd.read_csv(input_filename, dtype=str)
     print("読み込みが完了しました。")
 
     # 処理前の行数を確認
     rows_before = len(df)
     print(f"処理前の行数: {rows_before}")
-    
-    # 3. 欠損値を含む行をすべて削除します
-    print("\n欠損値を含む行を削除しています...")
-    df_cleaned = df.dropna()
-    print("削除が完了しました。")
 
-    # 処理後の行数を確認
+    # 3. 文字列を列ごとにまとめて数値に変換します
+    # 変換できない値（競走中止・オッズなし・計量不能など）の行は削除せず、欠損値とフラグの列で区別します
+    print("\n文字列を数値に変換しています...")
+    df_cleaned = normalize_race_results(df)
+    print("変換が完了しました。")
+    summarize_flags(df_cleaned)
+
+    # 処理後の行数を確認（行は削除しないため、処理前と同じ）
     rows_after = len(df_cleaned)
     print(f"処理後の行数: {rows_after}")
-    print(f"削除された行数: {rows_before - rows_after}")
+    print(f"欠損値を含む行の数: {rows_after - df_cleaned.notna().all(axis=1).sum()} (削除せずに残しています)")
 
     # 4. 処理後のデータを「新しいCSVファイル」として保存します
-    # df_cleaned に格納された、欠損行がないデータだけを output_filename で指定したファイルに書き出します。
     # 元の input_filename のファイルが変更されることはありません。
     print(f"\n処理後のデータを新しいファイル '{output_filename}' に保存しています...")
     df_cleaned.to_csv(output_filename, index=False, encoding='utf-8-sig')
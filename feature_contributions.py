@@ -0,0 +1,167 @@
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+
+def supports_contributions(model):
+    """
+    決定木の集まり（ランダムフォレスト、RaceRanker）で、決定経路から寄与度を求められるモデルかどうかを判定する関数
+    ヒストグラム型の勾配ブースティングは sklearn の決定木を持たないため対象外
+    """
+    return all(hasattr(tree, 'tree_') for tree in getattr(model, 'estimators_', [None]))
+
+
+def routed_paths(trees, features):
+    """
+    予測（apply）と同じ欠損値の分岐先をたどって、全ての木・全ての行の決定経路をまとめて作る関数
+    根から1段ずつ、全ての木の全ての行を同時に進めるため、繰り返しの回数は最も深い木の深さだけで済む
+    （親ノードの表のように全てのノードを調べる前処理はせず、経路上のノードだけを読む）
+
+    Args:
+        trees (list): sklearn の決定木の tree_ のリスト
+        features (np.ndarray): float32 の特徴量
+
+    Returns:
+        list: 木ごとの (path_nodes, path_lengths)
+              path_nodes は全ての行の経路を行の順に（各行の中は根から葉の順に）つなげたノード番号、
+              path_lengths は各行の経路のノード数
+    """
+    n_trees, n_rows = len(trees), len(features)
+    # ノードの配列（pickle と同じ tree_.__getstate__()['nodes']）を1ノード1行のバイト列として扱い、
+    # 木ごとに経路上のノードの行だけを取り出してから、まとめてノードの型として読む
+    node_dtype = trees[0].__getstate__()['nodes'].dtype
+    node_rows = [tree.__getstate__()['nodes'].view(np.uint8).reshape(-1, node_dtype.itemsize) for tree in trees]
+
+    rows = np.arange(n_rows)
+    current = np.zeros((n_trees, n_rows), dtype=np.intp)
+    levels = [current]
+    active = np.arange(n_trees)
+    while len(active):
+        nodes = np.concatenate([node_rows[i][current[i]] for i in active]).view(node_dtype)
+        nodes = nodes.reshape(len(active), n_rows)
+        is_leaf = nodes['left_child'] < 0
+        values = features[rows, np.where(is_leaf, 0, nodes['feature'])]
+        # 欠損値は学習時に決めた側（missing_go_to_left）へ、それ以外は閾値以下なら左へ進む
+        go_left = np.where(np.isnan(values), nodes['missing_go_to_left'] != 0, values <= nodes['threshold'])
+        current = current.copy()
+        current[active] = np.where(is_leaf, current[active], np.where(go_left, nodes['left_child'], nodes['right_child']))
+        levels.append(current)
+        active = active[~is_leaf.all(axis=1)]
+
+    # 葉に着いた後は同じノードが続くため、1段前と異なるノードだけが経路になる
+    levels = np.stack(levels, axis=2)
+    on_path = np.ones(levels.shape, dtype=bool)
+    on_path[:, :, 1:] = levels[:, :, 1:] != levels[:, :, :-1]
+    return [(levels[i][on_path[i]], on_path[i].sum(axis=1)) for i in range(n_trees)]
+
+
+def tree_contributions(model, X):
+    """
+    各行の予測値を「基準値 + 特徴量ごとの寄与度の和」に分解する関数
+    各木で、根から葉までの経路上の分岐ごとに (子ノードの値 - 親ノードの値) を分岐に使った特徴量の寄与とし、全ての木で合計する
+
+    木ごとに全行の決定経路をまとめて取り出し、全ての木の経路をつなげて、経路上の隣り合うノードの差を配列演算で求める
+    欠損値を含む場合の決定経路は、予測と同じ分岐先をたどる routed_paths で作る（decision_path は scikit-learn の
+    バージョンによって欠損値の行を学習時と違う子ノードに進めることがあり、寄与度の和が予測値と一致しなくなるため）
+
+    Args:
+        model: ランダムフォレスト（着順ごとの確率を平均する）もしくは RaceRanker（スコアを learning_rate 倍して足し合わせる）
+        X (pd.DataFrame): 学習時と同じ列順の特徴量
+
+    Returns:
+        tuple: (bias, contributions)
+               bias は (出力数,) の基準値、contributions は (行数, 特徴量数, 出力数) の寄与度
+               出力はランダムフォレストなら着順ごとの確率、RaceRanker ならスコア（出力数1）
+    """
+    features = np.ascontiguousarray(X, dtype=np.float32)
+    n_rows, n_features = features.shape
+    is_classifier = hasattr(model, 'classes_')
+    n_trees = len(model.estimators_)
+    tree_weight = 1.0 / n_trees if is_classifier else model.learning_rate
+
+    # 欠損値がなければ、decision_path と apply は同じ葉にたどり着く
+    missing_paths = None
+    if np.isnan(features).any():
+        missing_paths = routed_paths([tree.tree_ for tree in model.estimators_], features)
+
+    # 木ごとの処理は決定経路と、経路上のノードの値・分岐に使った特徴量の取り出しだけにする
+    # （入力チェックを省くため、推定器ではなく tree_ の decision_path を直接呼ぶ）
+    node_values, node_features, path_lengths = [], [], []
+    for i, tree in enumerate(model.estimators_):
+        if missing_paths is not None:
+            path_nodes, path_length = missing_paths[i]
+        else:
+            path = tree.tree_.decision_path(features)
+            path_nodes, path_length = path.indices, np.diff(path.indptr)
+        node_values.append(tree.tree_.value[path_nodes, 0, :] if is_classifier else tree.tree_.value[path_nodes, 0, :1])
+        node_features.append(tree.tree_.feature[path_nodes])
+        path_lengths.append(path_length)
+
+    # 以降は全ての木・全ての行の経路をつなげた1つの配列でまとめて計算する
+    node_values = np.concatenate(node_values)
+    if is_classifier:
+        # 分類木の値は着順ごとの割合に揃える
+        totals = node_values.sum(axis=1, keepdims=True)
+        node_values = node_values / np.where(totals > 0, totals, 1.0)
+    node_features = np.concatenate(node_features)
+    path_lengths = np.concatenate(path_lengths)
+    path_starts = np.concatenate(([0], np.cumsum(path_lengths)[:-1]))
+
+    # 各経路の先頭（根ノード）以外の要素が、1つ前の要素を親とする分岐にあたる
+    is_child = np.ones(len(node_values), dtype=bool)
+    is_child[path_starts] = False
+    child_positions = np.flatnonzero(is_child)
+    rows = np.repeat(np.tile(np.arange(n_rows), n_trees), path_lengths)[child_positions]
+    deltas = (node_values[child_positions] - node_values[child_positions - 1]) * tree_weight
+    # 根ノードの値は行によらないため、各木の1行目の経路の先頭を使う
+    bias = node_values[path_starts[::n_rows]].sum(axis=0) * tree_weight
+
+    # 全ての木の差を (行, 特徴量) ごとに、疎行列との1回の積で足し合わせる
+    targets = rows * n_features + node_features[child_positions - 1]
+    summation = sparse.csr_matrix(
+        (np.ones(len(targets)), (targets, np.arange(len(targets)))), shape=(n_rows * n_features, len(targets))
+    )
+    contributions = summation @ deltas
+    return bias, contributions.reshape(n_rows, n_features, len(bias))
+
+
+def explain_predictions(model, X):
+    """
+    各馬の予測を特徴量ごとの寄与度に分解する関数
+    ランダムフォレストは予測着順の期待値（マイナスほど上位方向）、RaceRanker はスコア（プラスほど上位方向）への寄与を返す
+
+    Args:
+        model: 学習済みモデル
+        X (pd.DataFrame): 学習時と同じ列順の特徴量
+
+    Returns:
+        tuple: (基準値, 寄与度のデータフレーム（行: 馬、列: 特徴量）)。寄与度を求められないモデルの場合は None
+    """
+    if not supports_contributions(model):
+        return None
+    bias, contributions = tree_contributions(model, X)
+    if hasattr(model, 'classes_'):
+        # 確率への寄与を着順で重み付けすると、期待値（Σ 着順 × 確率）への寄与になる
+        bias, contributions = bias @ model.classes_, contributions @ model.classes_
+    else:
+        bias, contributions = bias[0], contributions[:, :, 0]
+    return bias, pd.DataFrame(contributions, columns=X.columns, index=X.index)
+
+
+def format_contribution_table(horse_names, bias, contributions, total_label):
+    """
+    寄与度を、馬ごとに1行の表示用の表にまとめる関数
+
+    Args:
+        horse_names (pd.Series): 馬名
+        bias (float): 全馬に共通の基準値
+        contributions (pd.DataFrame): explain_predictions が返した寄与度
+        total_label (str): 基準値と寄与度の合計（予測値）の列名
+
+    Returns:
+        pd.DataFrame: 馬名・予測値・特徴量ごとの寄与度の表（行の並びは contributions と同じ）
+    """
+    table = contributions.copy()
+    table.insert(0, '馬名', horse_names.to_numpy())
+    table.insert(1, total_label, bias + contributions.sum(axis=1))
+    return table
@@ -0,0 +1,96 @@
+import os
+import re
+
+# 収集済みの全ての馬詳細ページURL（1行に1URL、新しい馬は末尾に追記する）
+FRONTIER_PATH = 'horse_urls_all_pages.txt'
+# 直近の収集で新しく見つかった馬のURLだけを書き出すファイル（scrape_all_horses.py に渡す）
+DELTA_PATH = 'horse_urls_new.txt'
+
+HORSE_URL_TEMPLATE = "https://db.netkeiba.com/horse/{horse_id}/"
+
+
+def extract_horse_id(url):
+    """
+    馬詳細ページのURLから馬IDを取り出す関数
+
+    Args:
+        url (str): 例: https://db.netkeiba.com/horse/2019105219/
+
+    Returns:
+        str: 馬ID。見つからない場合は None
+    """
+    match = re.search(r'/horse/([0-9A-Za-z]+)', url)
+    return match.group(1) if match else None
+
+
+class HorseFrontier:
+    """
+    収集済みの馬詳細ページURLを、馬IDをキーとした集合で管理するストア
+
+    URLの表記が違っても（末尾のスラッシュの有無など）同じ馬IDなら同じ馬として扱い、
+    複数の検索条件で見つかった馬も1つのリストに重複なくまとめる。
+    新しく見つかった馬だけを FRONTIER_PATH に追記するため、既存の馬を書き直すことはない。
+    """
+
+    def __init__(self, path=FRONTIER_PATH):
+        """
+        Args:
+            path (str): 収集済みURLのファイルパス。存在しない場合は空の状態から始める
+        """
+        self.path = path
+        self._ids = set()
+        self._pending = []
+        self.new_urls = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    horse_id = extract_horse_id(line.strip())
+                    if horse_id:
+                        self._ids.add(horse_id)
+
+    def __contains__(self, horse_id):
+        return horse_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, urls):
+        """
+        URLのリストのうち、まだ知らない馬のURLを登録する関数
+
+        Args:
+            urls (list): 馬詳細ページのURLのリスト
+
+        Returns:
+            list: 新しく登録した馬のURLのリスト（馬IDから作った表記に揃える）
+        """
+        added = []
+        for url in urls:
+            horse_id = extract_horse_id(url)
+            if horse_id and horse_id not in self._ids:
+                self._ids.add(horse_id)
+                added.append(HORSE_URL_TEMPLATE.format(horse_id=horse_id))
+        self._pending.extend(added)
+        self.new_urls.extend(added)
+        return added
+
+    def save(self):
+        """前回の保存以降に登録したURLを、収集済みURLのファイルに追記する"""
+        if not self._pending:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for url in self._pending:
+                f.write(url + "\n")
+        self._pending = []
+
+    def write_delta(self, delta_path=DELTA_PATH):
+        """
+        このインスタンスで新しく登録したURLだけをファイルに書き出す関数（新しい馬がいない場合は空のファイルになる）
+
+        Returns:
+            int: 書き出したURLの件数
+        """
+        with open(delta_path, 'w', encoding='utf-8') as f:
+            for url in self.new_urls:
+                f.write(url + "\n")
+        return len(self.new_urls)
@@ -1,32 +1,30 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import NoSuchElementException
+import argparse
 import time
+from urllib.parse import urlparse, parse_qs, urlencode
 
-def scrape_horse_list_urls(url):
+from scrape_shutsuba import create_driver
+from horse_frontier import HorseFrontier, FRONTIER_PATH, DELTA_PATH
+
+# 馬リストの検索条件（3歳以上・重賞）。並び順（sort=...）は with_sort で付ける
+BASE_QUERY_URL = "https://db.netkeiba.com/?pid=horse_list&word=&match=partial_match&sire=&keito=&mare=&bms=&trainer=&owner=&breeder=&sex%5B%5D=1&sex%5B%5D=2&under_age=3&over_age=none&under_birthmonth=1&over_birthmonth=12&under_birthday=1&over_birthday=31&grade%5B%5D=4&grade%5B%5D=3&prize_min=&prize_max=&list=100"
+# 生まれ年の新しい馬（新しく検索結果に加わる馬）から順に並べる並び順。既知の馬だけのページ以降に新しい馬は現れない
+NEWEST_FIRST_SORT = 'birthyear'
+# 賞金順。新しく加わった賞金の少ない馬は後ろのページに並ぶため、最大ページまで巡回する場合（--prize-full-crawl）にだけ使う
+PRIZE_SORT = 'prize'
+
+def scrape_horse_list_urls(url, driver):
     """
     指定されたnetkeiba.comの馬リストページから各馬の詳細ページURLを抽出する関数
 
     Args:
         url (str): netkeiba.comの馬リストページのURL
+        driver: 使用するSeleniumのWebDriverインスタンス（複数ページで使い回す）
 
     Returns:
         list: 抽出された馬詳細ページのURLのリスト
     """
-    # Chromeドライバーのセットアップ
-    service = Service(ChromeDriverManager().install())
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')  # ブラウザを非表示で実行
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    # headless実行時にウィンドウサイズを指定しないと要素が見つからない場合があるため追加
-    options.add_argument('window-size=1920x1080')
-
-
-    # driverの初期化はtry-exceptの外で行う
-    driver = webdriver.Chrome(service=service, options=options)
     horse_detail_urls_on_page = [] # このページで抽出したURLを格納するリスト
 
     try:
@@ -44,7 +42,6 @@ def scrape_horse_list_urls(url):
         
         if not rows: # 行が見つからなかった場合
             print(f"URL: {url} で馬リストの行が見つかりませんでした。")
-            driver.quit()
             return []
 
         print(f"URL: {url} で {len(rows)} 件の行が見つかりました。")
@@ -69,59 +66,101 @@ def scrape_horse_list_urls(url):
         print(f"URL: {url} で馬リストのテーブルが見つかりませんでした。")
     except Exception as e:
         print(f"URL: {url} の処理中にエラーが発生しました: {e}")
-    finally:
-        driver.quit() # tryブロック内でエラーが発生しても必ずWebDriverを閉じる
 
     return horse_detail_urls_on_page
 
+def with_sort(query_url, sort):
+    """検索条件のURLの並び順（sort=...）を sort に置き換えたURLを返す関数"""
+    parsed = urlparse(query_url)
+    params = [(key, value) for key, value in parse_qs(parsed.query, keep_blank_values=True).items() if key != 'sort']
+    return parsed._replace(query=urlencode(params + [('sort', sort)], doseq=True)).geturl()
+
+
+def lists_newest_first(query_url):
+    """
+    新しい馬から順に並ぶ検索条件（既知の馬だけのページで巡回を打ち切ってよい検索条件）かどうかを判定する関数
+    賞金順などの検索結果では新しく加わった馬が後ろのページに現れるため、既知の馬だけのページがあっても
+    以降のページに新しい馬がいないとは言えない
+
+    Args:
+        query_url (str): 馬リストの検索結果のURL
+
+    Returns:
+        bool: 新しい馬から順に並ぶ場合は True
+    """
+    return parse_qs(urlparse(query_url).query).get('sort', [''])[0] == NEWEST_FIRST_SORT
+
+
+def discover_new_horses(query_urls, max_page=49, known_pages_to_stop=1,
+                        frontier_path=FRONTIER_PATH, delta_path=DELTA_PATH):
+    """
+    複数の検索条件の馬リストを巡回し、まだ知らない馬のURLだけを収集済みURLに追加する関数
+    新しい馬が1頭もいないページが known_pages_to_stop ページ続いた時点で、以降のページも既知の馬とみなして
+    その検索条件の巡回を打ち切る（新しい馬から順に並ぶ検索条件で使う。最大ページまで巡回する場合は known_pages_to_stop を None にする）
+
+    Args:
+        query_urls (list): 馬リストの検索結果のURL（年齢・グレードなどの条件ごと、page=N は付けない）
+        max_page (int): 1つの検索条件で巡回する最大ページ数
+        known_pages_to_stop (int): 巡回を打ち切るまでに続く、既知の馬だけのページ数。Noneの場合は打ち切らない
+        frontier_path (str): 収集済みURLのファイルパス（新しい馬を追記する）
+        delta_path (str): 今回新しく見つかった馬のURLだけを書き出すファイルパス
+
+    Returns:
+        list: 今回新しく見つかった馬のURLのリスト
+    """
+    frontier = HorseFrontier(frontier_path)
+    print(f"収集済みの馬: {len(frontier)}頭")
+
+    driver = create_driver()
+    try:
+        for query_url in query_urls:
+            print(f"\n--- 検索条件: {query_url} ---")
+            known_pages = 0
+            if known_pages_to_stop is not None and not lists_newest_first(query_url):
+                print(f"警告: この検索条件は新しい馬から順に並ばない（sort={NEWEST_FIRST_SORT} ではない）ため、"
+                      "巡回を打ち切った後のページに新しい馬がいる可能性があります。最後まで巡回するには --full を指定してください。")
+            for page_num in range(1, max_page + 1):
+                # 1ページ目は元のURL、2ページ目以降は &page=N を付ける
+                page_url = query_url if page_num == 1 else f"{query_url}&page={page_num}"
+                print(f"処理中: {page_num}ページ目 - URL: {page_url}")
+                urls_from_page = scrape_horse_list_urls(page_url, driver)
+                if not urls_from_page:
+                    print(f"{page_num}ページ目からURLは抽出されませんでした。この検索条件の巡回を終了します。")
+                    break
+
+                new_urls = frontier.add(urls_from_page)
+                # 途中で止まっても、ここまでに見つかった馬を失わないようにページごとに保存する
+                frontier.save()
+                print(f"{page_num}ページ目: {len(urls_from_page)}件中 {len(new_urls)}件が新しい馬です。")
+                known_pages = 0 if new_urls else known_pages + 1
+                if known_pages_to_stop is not None and known_pages >= known_pages_to_stop:
+                    print("新しい馬がいないため、この検索条件の以降のページは巡回しません。")
+                    break
+    finally:
+        driver.quit() # エラーが発生しても必ずWebDriverを閉じる
+
+    n_new = frontier.write_delta(delta_path)
+    print(f"\n新しく見つかった馬: {n_new}頭 (収集済み: 合計{len(frontier)}頭)")
+    print(f"新しい馬のURLを '{delta_path}' に保存しました。")
+    print(f"続けて python scrape_all_horses.py {delta_path} を実行すると、新しい馬の戦績だけを取得します。")
+    return frontier.new_urls
+
+
 if __name__ == '__main__':
-    base_target_list_url = "https://db.netkeiba.com/?pid=horse_list&word=&match=partial_match&sire=&keito=&mare=&bms=&trainer=&owner=&breeder=&sex%5B%5D=1&sex%5B%5D=2&under_age=3&over_age=none&under_birthmonth=1&over_birthmonth=12&under_birthday=1&over_birthday=31&grade%5B%5D=4&grade%5B%5D=3&prize_min=&prize_max=&sort=prize&list=100"
-    
-    all_extracted_urls = []
-    max_page = 49  # ユーザーの指示通り49ページまで
-
-    # 1ページ目 (元のURL、page=1相当)
-    print(f"処理中: 1ページ目 - URL: {base_target_list_url}")
-    urls_from_page = scrape_horse_list_urls(base_target_list_url)
-    if urls_from_page:
-        all_extracted_urls.extend(urls_from_page)
-        print(f"1ページ目から {len(urls_from_page)} 件のURLを抽出しました。")
-    else:
-        print(f"1ページ目 ({base_target_list_url}) からURLは抽出されませんでした。")
-    
-    # 2ページ目から指定された最大ページまで
-    for page_num in range(2, max_page + 1):
-        target_url_with_page = f"{base_target_list_url}&page={page_num}"
-        print(f"処理中: {page_num}ページ目 - URL: {target_url_with_page}")
-        
-        urls_from_page = scrape_horse_list_urls(target_url_with_page)
-        if urls_from_page:
-            all_extracted_urls.extend(urls_from_page)
-            print(f"{page_num}ページ目から {len(urls_from_page)} 件のURLを抽出しました。")
-        else:
-            print(f"{page_num}ページ目 ({target_url_with_page}) からURLは抽出されませんでした。")
-        
-        # サーバーへの負荷を考慮して、リクエスト間に短い待機時間を設ける
-        # scrape_horse_list_urls 関数内で既に3秒の待機があるため、
-        # ここでの追加待機は任意ですが、長時間の連続アクセスでは推奨されます。
-        # time.sleep(1) # 例: 1秒待機
-
-    # 全ての抽出結果を表示・保存
-    if all_extracted_urls:
-        print(f"\n--- 全ページから抽出された馬詳細ページのURL (合計: {len(all_extracted_urls)}件) ---")
-        # 全URLの表示は長くなる可能性があるため、必要に応じてコメントアウトを解除してください
-        # for url in all_extracted_urls:
-        #     print(url)
-        
-        # 重複を削除したい場合は以下のようにセットに変換してからリストに戻す
-        # unique_urls = list(set(all_extracted_urls))
-        # print(f"\n重複を除いたURLの件数: {len(unique_urls)}")
-
-        # ファイルに保存する場合の例
-        output_filename = "horse_urls_all_pages.txt"
-        with open(output_filename, "w", encoding='utf-8') as f:
-            for url in all_extracted_urls: # 重複を許す場合は all_extracted_urls, 除く場合は unique_urls
-                f.write(url + "\n")
-        print(f"\n抽出されたURLを '{output_filename}' に保存しました。")
+    parser = argparse.ArgumentParser(description="netkeibaの馬リストから、まだ収集していない馬の詳細ページURLを収集します。")
+    parser.add_argument('--query', action='append', metavar='URL',
+                        help="馬リストの検索結果のURL（年齢・グレードの条件を変えて複数指定可。省略時は3歳以上・重賞の新しい馬順）")
+    parser.add_argument('--max-page', type=int, default=49, help="1つの検索条件で巡回する最大ページ数（デフォルト: 49）")
+    parser.add_argument('--stop-after', type=int, default=1, metavar='PAGES',
+                        help="新しい馬がいないページがこのページ数続いたら、その検索条件の巡回を打ち切る（デフォルト: 1）")
+    parser.add_argument('--full', action='store_true',
+                        help="既知の馬だけのページがあっても打ち切らず、最大ページまで巡回する")
+    parser.add_argument('--prize-full-crawl', action='store_true',
+                        help="3歳以上・重賞の賞金順の検索結果を、打ち切らずに最大ページまで巡回する（以前の既定の巡回）")
+    args = parser.parse_args()
+
+    if args.prize_full_crawl:
+        discover_new_horses([with_sort(BASE_QUERY_URL, PRIZE_SORT)], max_page=args.max_page, known_pages_to_stop=None)
     else:
-        print("URLは一件も抽出されませんでした。")
\ No newline at end of file
+        discover_new_horses(args.query or [with_sort(BASE_QUERY_URL, NEWEST_FIRST_SORT)], max_page=args.max_page,
+                            known_pages_to_stop=None if args.full else args.stop_after)
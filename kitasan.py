@@ -4,7 +4,8 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import NoSuchElementException
 import time
-import re
+
+from normalize_race_data import assign_horse_weights
 
 def scrape_kitasan_black_races(url):
     """
@@ -62,17 +63,7 @@ def scrape_kitasan_black_races(url):
             kinryo = row.find_element(By.XPATH, './td[14]').text.strip()
             baba_condition = row.find_element(By.XPATH, './td[16]').text.strip()
             horse_weight_full = row.find_element(By.XPATH, './td[24]').text.strip() # "534(+4)"など
-
-            # 馬体重と増減を分割
-            horse_weight = ""
-            horse_weight_diff = ""
-            match = re.match(r'(\d+)\((.*?)\)', horse_weight_full)
-            if match:
-                horse_weight = match.group(1)
-                horse_weight_diff = match.group(2)
-            elif horse_weight_full.isdigit(): # 増減がない場合 (例: "500")
-                horse_weight = horse_weight_full
-                horse_weight_diff = "0"
+            # 馬体重と増減の分割は、全レース分まとめて最後に行う
 
 
             race_info = {
@@ -88,8 +79,8 @@ def scrape_kitasan_black_races(url):
                 "騎手": jockey,
                 "斤量": kinryo,
                 "馬場": baba_condition,
-                "馬体重": horse_weight,
-                "馬体重の増減": horse_weight_diff,
+                "馬体重": horse_weight_full,
+                "馬体重の増減": "",
                 # "レース詳細URL": race_url # 参考
             }
             race_data_list.append(race_info)
@@ -108,6 +99,8 @@ def scrape_kitasan_black_races(url):
             continue
 
     driver.quit()
+    # 馬体重の文字列を全レース分まとめて体重と増減に分ける
+    assign_horse_weights(race_data_list)
     return race_data_list
 
 if __name__ == '__main__':
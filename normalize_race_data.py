@@ -0,0 +1,242 @@
+import pandas as pd
+import numpy as np
+import argparse
+import time
+import re
+
+# 着順区分のコード（着順の列に入っている文字から決める）
+FINISH_STATUS_CODES = {'完走': 0, '中止': 1, '取消': 2, '除外': 3, '失格': 4, '不明': 5}
+# 着順の列に入る完走以外の記号と、その着順区分
+NON_FINISH_MARKERS = {'中': '中止', '取': '取消', '除': '除外', '失': '失格'}
+
+# 行を削除する代わりに付けるフラグの列（学習時は特徴量に含めない）
+FLAG_COLS = ['着順区分', 'オッズ欠損', '馬体重欠損']
+
+# レースを一意に表す netkeiba の race_id（12桁）の列。同じレースの出走馬をまとめるためだけに使い、特徴量には含めない
+RACE_ID_COL = 'race_id'
+
+# 文字列から数値に変換する列（R・着順・馬体重は個別に処理する）
+PLAIN_NUMERIC_COLS = ['頭数', '枠番', '馬番', 'オッズ', '人気', '斤量']
+
+# "480(+4)" を体重・括弧の中身に分ける正規表現（括弧がない "480" や、"計不" のような計測不能の値にも一致する）
+HORSE_WEIGHT_PATTERN = r'^\s*(?P<weight>\d+)?\s*(?P<paren>\((?P<diff>[^)]*)\))?'
+
+
+def _parse_unique_values(values, parse):
+    """
+    列の値を重複のない値にまとめてから parse で変換し、factorize のコードで全行に配り直す関数
+    着順・オッズ・馬体重などは値の種類が行数よりはるかに少ないため、文字列の処理は種類の数だけで済み、
+    行数に比例する処理は factorize とコードによる配列の取り出しだけになる
+
+    Args:
+        values (pd.Series): 変換する列
+        parse (callable): 前後の空白を除いた重複のない値（空文字は欠損値）の pd.Series を受け取り、
+                          同じ長さの pd.Series もしくは pd.DataFrame を返す関数
+
+    Returns:
+        pd.Series or pd.DataFrame: values と同じインデックスの変換結果
+    """
+    codes, uniques = pd.factorize(values)
+    # 末尾に欠損値を1つ加え、欠損値の行（コード -1）はそこを参照させる
+    uniques = pd.Series(np.append(np.asarray(uniques, dtype=object), None), dtype='string').str.strip()
+    parsed = parse(uniques.mask(uniques == ''))
+    parsed = parsed.iloc[np.where(codes < 0, len(uniques) - 1, codes)]
+    parsed.index = values.index
+    return parsed
+
+
+def _extract_horse_weight(weight_text):
+    """馬体重の文字列を str.extract で (体重, 増減, 括弧の有無) に分ける"""
+    parts = weight_text.str.extract(HORSE_WEIGHT_PATTERN)
+    return pd.DataFrame({
+        'weight': pd.to_numeric(parts['weight'], errors='coerce'),
+        'diff': pd.to_numeric(parts['diff'].str.strip(), errors='coerce'),
+        'has_paren': parts['paren'].notna(),
+    })
+
+
+def _parse_finish(finish_text):
+    """着順の文字列を (着順, 着順区分) に分ける（"3(降)" のような降着は数字の部分を着順とする）"""
+    parts = finish_text.str.extract(r'^(?:(?P<finish>\d+)|(?P<marker>[中取除失]))')
+    finish = pd.to_numeric(parts['finish'], errors='coerce')
+    status = parts['marker'].map(NON_FINISH_MARKERS).map(FINISH_STATUS_CODES)
+    status = status.where(finish.isna(), FINISH_STATUS_CODES['完走']).fillna(FINISH_STATUS_CODES['不明'])
+    return pd.DataFrame({'finish': finish, 'status': status})
+
+
+def _to_number(text):
+    return pd.to_numeric(text, errors='coerce')
+
+
+def split_horse_weight(weight_text):
+    """
+    "480(+4)" のような馬体重の文字列の列を、体重と増減の列にまとめて分ける関数
+    括弧がない "480" は増減0、"計不" や "--" のような計測不能の値は体重・増減とも欠損値になる
+
+    Args:
+        weight_text (pd.Series): 馬体重の生の文字列
+
+    Returns:
+        pd.DataFrame: '馬体重' と '馬体重の増減' の列（欠損値を持てる整数型）
+    """
+    parts = _parse_unique_values(weight_text, _extract_horse_weight)
+    diff = parts['diff'].where(parts['has_paren'] | parts['weight'].isna(), 0)
+    return pd.DataFrame({'馬体重': parts['weight'].astype('Int64'), '馬体重の増減': diff.astype('Int64')})
+
+
+def assign_horse_weights(records):
+    """
+    スクレイピングで集めた辞書のリストの '馬体重'（生の文字列）をまとめて分け、'馬体重' と '馬体重の増減' を上書きする関数
+    1行ずつ正規表現を当てる代わりに、全行を split_horse_weight で一度に処理する
+    """
+    if not records:
+        return
+    weights = split_horse_weight(pd.Series([record['馬体重'] for record in records]))
+    for record, weight, diff in zip(records, weights['馬体重'].astype(object), weights['馬体重の増減'].astype(object)):
+        record['馬体重'] = weight
+        record['馬体重の増減'] = diff
+
+
+def normalize_race_results(df):
+    """
+    スクレイピングした生の文字列のレース結果を、列単位の配列演算でまとめて数値に変換する関数
+    変換できない値があっても行は削除せず、欠損値にしてフラグの列（FLAG_COLS）に理由を残す
+
+    - 着順: "中"/"取"/"除"/"失" は着順を欠損値にして、着順区分を 中止/取消/除外/失格 にする
+    - オッズ: "---" などは欠損値にして、オッズ欠損を1にする
+    - 馬体重: "480(+4)" は体重と増減に分け、"計不" などは欠損値にして、馬体重欠損を1にする
+      （スクレイパーで分割済みの場合は、馬体重の増減の列をそのまま使う）
+
+    Args:
+        df (pd.DataFrame): スクレイピングした出走データ（文字列のままでもよい）
+
+    Returns:
+        pd.DataFrame: 数値列を float32 にし、FLAG_COLS を末尾に加えたデータ（行数は df と同じ）
+    """
+    columns = {}
+    flags = {}
+    for col in df.columns:
+        if col == '着順':
+            parts = _parse_unique_values(df[col], _parse_finish)
+            columns[col] = parts['finish'].astype(np.float32)
+            flags['着順区分'] = parts['status'].astype(np.int8)
+        elif col == 'R':
+            # "11R" のような表記から数字だけを取り出す
+            columns[col] = _parse_unique_values(
+                df[col], lambda text: _to_number(text.str.extract(r'(\d+)', expand=False))).astype(np.float32)
+        elif col in PLAIN_NUMERIC_COLS:
+            columns[col] = _parse_unique_values(df[col], _to_number).astype(np.float32)
+        elif col == '馬体重':
+            parts = _parse_unique_values(df[col], _extract_horse_weight)
+            weight, diff, has_paren = parts['weight'], parts['diff'], parts['has_paren']
+            if '馬体重の増減' in df.columns:
+                # 分割済みのデータは、括弧が無ければ増減の列の値を使う
+                diff = diff.where(has_paren, _parse_unique_values(df['馬体重の増減'], _to_number))
+            diff = diff.where(has_paren | weight.isna() | diff.notna(), 0)
+            columns[col] = weight.astype(np.float32)
+            columns['馬体重の増減'] = diff.where(weight.notna()).astype(np.float32)
+            flags['馬体重欠損'] = weight.isna().astype(np.int8)
+        elif col == '馬体重の増減' and '馬体重' in df.columns:
+            columns.setdefault(col, None)  # 馬体重と一緒に処理する（列の順番だけ確保する）
+        else:
+            # 文字列の列は前後の空白を除き、空文字を欠損値にする
+            columns[col] = _parse_unique_values(df[col], lambda text: text.astype(object).where(text.notna(), np.nan))
+
+    if 'オッズ' in columns:
+        flags['オッズ欠損'] = columns['オッズ'].isna().astype(np.int8)
+    return pd.DataFrame({**columns, **{col: flags[col] for col in FLAG_COLS if col in flags}}, index=df.index)
+
+
+def summarize_flags(df):
+    """normalize_race_results が付けたフラグの件数を表示する関数"""
+    if '着順区分' in df.columns:
+        names = {code: name for name, code in FINISH_STATUS_CODES.items()}
+        counts = df['着順区分'].map(names).value_counts()
+        print("着順区分: " + ", ".join(f"{name} {counts.get(name, 0)}件" for name in FINISH_STATUS_CODES))
+    for col in ['オッズ欠損', '馬体重欠損']:
+        if col in df.columns:
+            print(f"{col}: {int(df[col].sum())}件")
+
+
+def _make_raw_rows(n_rows, random_state=42):
+    """ベンチマーク用に、実際のスクレイピング結果と同じ形の生の文字列を n_rows 行作る"""
+    rng = np.random.RandomState(random_state)
+    finish = rng.randint(1, 19, n_rows).astype(str).astype(object)
+    non_finish = rng.rand(n_rows) < 0.02
+    finish[non_finish] = rng.choice(list(NON_FINISH_MARKERS), non_finish.sum())
+
+    odds = np.char.mod('%.1f', rng.gamma(1.5, 15.0, n_rows) + 1.0).astype(object)
+    odds[rng.rand(n_rows) < 0.01] = '---'
+
+    weight = rng.randint(400, 560, n_rows)
+    diff = rng.randint(-12, 13, n_rows)
+    weight_text = pd.Series(weight.astype(str)) + '(' + pd.Series(np.where(diff > 0, '+', '')) + diff.astype(str) + ')'
+    weight_text = weight_text.to_numpy(dtype=object)
+    weight_text[rng.rand(n_rows) < 0.01] = '計不'
+
+    return pd.DataFrame({
+        'レース名': 'レース' + pd.Series(rng.randint(0, 500, n_rows).astype(str)),
+        'R': rng.randint(1, 13, n_rows).astype(str),
+        '頭数': rng.randint(8, 19, n_rows).astype(str),
+        '枠番': rng.randint(1, 9, n_rows).astype(str),
+        '馬番': rng.randint(1, 19, n_rows).astype(str),
+        'オッズ': odds,
+        '人気': rng.randint(1, 19, n_rows).astype(str),
+        '着順': finish,
+        '斤量': rng.choice(['54', '55', '56', '57', '58'], n_rows),
+        '馬体重': weight_text,
+    })
+
+
+def _normalize_row_by_row(raw):
+    """比較用: これまでのスクレイパーと同じく、1行ずつ正規表現と数値変換を行う"""
+    rows = []
+    for record in raw.to_dict('records'):
+        match = re.match(r'(\d+)\((.*?)\)', record['馬体重'])
+        if match:
+            record['馬体重'], record['馬体重の増減'] = match.group(1), match.group(2)
+        elif record['馬体重'].isdigit():
+            record['馬体重の増減'] = '0'
+        else:
+            record['馬体重'], record['馬体重の増減'] = '', ''
+        for col in ['着順', 'オッズ', '馬体重', '馬体重の増減']:
+            try:
+                record[col] = float(record[col])
+            except ValueError:
+                record[col] = np.nan
+        rows.append(record)
+    return pd.DataFrame(rows)
+
+
+def benchmark_normalization(n_rows=2_000_000):
+    """
+    生の文字列 n_rows 行の正規化にかかる時間を、列単位の処理と1行ずつの処理で比べる関数
+
+    Args:
+        n_rows (int): ベンチマークに使う行数
+    """
+    print(f"--- {n_rows}行の生データを作成 ---")
+    raw = _make_raw_rows(n_rows)
+
+    started_at = time.perf_counter()
+    normalized = normalize_race_results(raw)
+    vectorized_seconds = time.perf_counter() - started_at
+    summarize_flags(normalized)
+
+    # 1行ずつの処理は時間がかかるため、一部の行で計測して全体に換算する
+    sample_rows = min(n_rows, 200_000)
+    started_at = time.perf_counter()
+    _normalize_row_by_row(raw.iloc[:sample_rows])
+    row_by_row_seconds = (time.perf_counter() - started_at) * n_rows / sample_rows
+
+    print("\n--- ★★★ 正規化のスループット ★★★ ---")
+    print(f"列単位の処理: {vectorized_seconds:.2f}秒 ({n_rows / vectorized_seconds:,.0f}行/秒)")
+    print(f"1行ずつの処理: {row_by_row_seconds:.2f}秒 ({n_rows / row_by_row_seconds:,.0f}行/秒、{sample_rows}行から換算)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="生のレース結果の正規化のスループットを計測します（正規化自体は clean_csv.py で行います）。")
+    parser.add_argument('--rows', type=int, default=2_000_000, help="ベンチマークに使う行数（デフォルト: 2000000）")
+    args = parser.parse_args()
+
+    benchmark_normalization(args.rows)
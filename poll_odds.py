@@ -0,0 +1,300 @@
+import pandas as pd
+import numpy as np
+import argparse
+import html
+import json
+import os
+import time
+
+from scrape_shutsuba import create_driver, scrape_race_card
+from predict_race import load_model_and_encoders, preprocess_predict_data, is_ranking_model
+from prediction_cache import PredictionCache
+
+# 出馬表の全行から馬番・オッズ・人気のセルだけを1回のJavaScript実行でまとめて読み取る
+# （セルごとに find_element を呼ぶとWebDriverとの往復が頭数×列数だけ発生するため）
+ODDS_SNAPSHOT_SCRIPT = """
+var rows = document.querySelectorAll('.RaceTable01 tr');
+var snapshot = [];
+for (var i = 0; i < rows.length; i++) {
+    var cells = rows[i].getElementsByTagName('td');
+    if (cells.length < 11) { continue; }
+    snapshot.push([cells[1].innerText.trim(), cells[9].innerText.trim(), cells[10].innerText.trim()]);
+}
+return snapshot;
+"""
+
+
+def scrape_odds_snapshot(driver):
+    """
+    読み込み済みの出馬表ページからオッズと人気だけを取得する関数
+
+    Args:
+        driver: 出馬表ページを読み込み済みのSeleniumのWebDriverインスタンス
+
+    Returns:
+        dict: 馬番をキー、(オッズ, 人気) の文字列のタプルを値とする辞書
+    """
+    snapshot = driver.execute_script(ODDS_SNAPSHOT_SCRIPT) or []
+    return {uma_ban: (odds, popularity) for uma_ban, odds, popularity in snapshot}
+
+
+def diff_odds_snapshot(previous, current):
+    """
+    前回と今回のオッズ・人気を比較し、値が変わった馬番を返す関数
+
+    Args:
+        previous (dict): 前回の scrape_odds_snapshot の結果
+        current (dict): 今回の scrape_odds_snapshot の結果
+
+    Returns:
+        list: オッズもしくは人気が変わった馬番のリスト
+    """
+    return [uma_ban for uma_ban, values in current.items() if previous.get(uma_ban) != values]
+
+
+def format_rankings(horse_names, uma_bans, predictions_proba, classes):
+    """
+    各馬の着順確率から、表示用の順位表を作る関数
+
+    Args:
+        horse_names (pd.Series): 馬名
+        uma_bans (pd.Series): 馬番
+        predictions_proba (np.ndarray): 各馬の着順ごとの確率
+        classes (np.ndarray): 確率の各列に対応する着順
+
+    Returns:
+        pd.DataFrame: 期待値の昇順に並べた順位表
+    """
+    # 1着クラスが学習データに無い場合に備え、列を探してから取り出す
+    win_column = np.flatnonzero(classes == 1)
+    win_proba = predictions_proba[:, win_column[0]] if len(win_column) else np.zeros(len(predictions_proba))
+    results_df = pd.DataFrame({
+        '馬番': uma_bans.to_numpy(),
+        '馬名': horse_names.to_numpy(),
+        '1着確率': win_proba,
+        '予測着順 (期待値)': predictions_proba @ classes,
+    })
+    return results_df.sort_values(by='予測着順 (期待値)')
+
+
+def rescore_changed_horses(model, cache, X_current, predictions_proba, row_positions, previous_snapshot, current_snapshot):
+    """
+    オッズ・人気が変わった馬だけ特徴量を書き換えて再予測し、確率表の該当行をその場で置き換える関数
+
+    Args:
+        model: 学習済みの着順分類モデル
+        cache (PredictionCache): 予測キャッシュ
+        X_current (pd.DataFrame): 現在の特徴量（変わった馬の行を上書きする）
+        predictions_proba (np.ndarray): 現在の着順ごとの確率（変わった馬の行を上書きする）
+        row_positions (dict): 馬番をキー、X_current の行位置を値とする辞書
+        previous_snapshot (dict): 前回のオッズ・人気（今回の値で更新する）
+        current_snapshot (dict): 今回の scrape_odds_snapshot の結果
+
+    Returns:
+        list: オッズもしくは人気が変わった馬番のリスト
+    """
+    changed = [uma_ban for uma_ban in diff_odds_snapshot(previous_snapshot, current_snapshot)
+               if uma_ban in row_positions]
+    previous_snapshot.update(current_snapshot)
+    if not changed:
+        return changed
+
+    positions = [row_positions[uma_ban] for uma_ban in changed]
+    odds_values = pd.to_numeric(pd.Series([current_snapshot[u][0] for u in changed]), errors='coerce')
+    popularity_values = pd.to_numeric(pd.Series([current_snapshot[u][1] for u in changed]), errors='coerce')
+
+    # "---" など数値にできない値（取消など）は前回の値を残す
+    odds_col = X_current.columns.get_loc('オッズ')
+    popularity_col = X_current.columns.get_loc('人気')
+    for position, odds, popularity in zip(positions, odds_values, popularity_values):
+        if not np.isnan(odds):
+            X_current.iat[position, odds_col] = odds
+        if not np.isnan(popularity):
+            X_current.iat[position, popularity_col] = popularity
+
+    # 変わった馬だけを再予測し、確率表の該当行を置き換える
+    predictions_proba[positions] = cache.predict_proba(model, X_current.iloc[positions])
+    return changed
+
+
+def poll_race_odds(url, interval=60, cycles=None):
+    """
+    出馬表のオッズと人気を定期的に取得し、値が変わった馬だけを再予測する関数
+
+    Args:
+        url (str): netkeibaの出馬表ページのURL（ローカルの代替ページ file://... も可）
+        interval (int): ポーリング間隔（秒）
+        cycles (int): ポーリング回数。Noneの場合は Ctrl+C で止めるまで続ける
+    """
+    # --- 1. モデルの読み込みと初回の全頭予測 ---
+    print("--- 1. モデル、エンコーダーの読み込み ---")
+    model, encoders = load_model_and_encoders()
+    if model is None:
+        return
+    if is_ranking_model(model):
+        # 1着確率や期待値は着順ごとの確率から求めるため、順位付けモデルでは使えない
+        print("エラー: オッズの追跡は着順分類モデル（train_model.py を --rank なしで実行）にのみ対応しています。")
+        return
+
+    driver = create_driver()
+    try:
+        print("\n--- 2. 出馬表の取得と初回予測 ---")
+        horses = scrape_race_card(url, None, driver)
+        if not horses:
+            print("出馬表を取得できなかったため、終了します。")
+            return
+
+        card_df = pd.DataFrame(horses)
+        X_current = preprocess_predict_data(card_df, model, encoders)
+        if X_current is None:
+            return
+        # 同じ特徴量に戻った馬（オッズが元に戻った場合など）は再計算しない
+        cache = PredictionCache()
+        predictions_proba = cache.predict_proba(model, X_current)
+        # 馬番から行位置を引けるようにしておく
+        row_positions = {uma_ban: i for i, uma_ban in enumerate(card_df['馬番'])}
+        previous_snapshot = {
+            uma_ban: (odds, popularity)
+            for uma_ban, odds, popularity in zip(card_df['馬番'], card_df['オッズ'], card_df['人気'])
+        }
+
+        print("\n--- ★★★ 初回予測結果 ★★★ ---")
+        pd.options.display.float_format = '{:.2f}'.format
+        print(format_rankings(card_df['馬名'], card_df['馬番'], predictions_proba, model.classes_).to_string(index=False))
+
+        # --- 3. オッズのポーリング ---
+        print(f"\n--- 3. オッズのポーリング開始 (間隔: {interval}秒) ---")
+        cycle = 0
+        while cycles is None or cycle < cycles:
+            time.sleep(interval)
+            cycle += 1
+
+            cycle_started_at = time.perf_counter()
+            driver.refresh()
+            current_snapshot = scrape_odds_snapshot(driver)
+            fetched_at = time.perf_counter()
+
+            changed = rescore_changed_horses(model, cache, X_current, predictions_proba, row_positions,
+                                             previous_snapshot, current_snapshot)
+            scored_at = time.perf_counter()
+
+            print(f"\n[{cycle}回目] 変更 {len(changed)}頭 / 取得 {fetched_at - cycle_started_at:.3f}秒"
+                  f" / 再予測 {scored_at - fetched_at:.3f}秒 / 合計 {scored_at - cycle_started_at:.3f}秒")
+            if changed:
+                print(f"オッズが変わった馬番: {', '.join(changed)}")
+                print(format_rankings(card_df['馬名'], card_df['馬番'], predictions_proba, model.classes_).to_string(index=False))
+                cache.print_stats()
+    except KeyboardInterrupt:
+        print("\nポーリングを終了します。")
+    finally:
+        driver.quit()
+
+
+def stand_in_odds(base_odds, tick):
+    """
+    代替出馬表ページが tick 番目の時間帯に表示するオッズと人気を求める関数
+    3頭に1頭ずつ、時間帯によって決まる割合で元のオッズを変動させ、人気をオッズの低い順に付け直す
+
+    Args:
+        base_odds (list): 出馬表の並び順の元のオッズ（文字列。"---" などはそのまま表示する）
+        tick (int): 時間帯の番号（change_seconds 秒ごとに1増える）
+
+    Returns:
+        list: 出馬表の並び順の (オッズ, 人気) の文字列のタプルのリスト
+    """
+    odds = pd.to_numeric(pd.Series(base_odds, dtype=object), errors='coerce').to_numpy(dtype=float)
+    rows = np.arange(len(odds))
+    varies = ((tick + rows) % 3 == 0) & ~np.isnan(odds)
+    factor = 1 + 0.2 * np.sin(tick * 0.7 + rows)
+    odds = np.where(varies, np.maximum(1.1, np.round(odds * factor, 1)), odds)
+
+    # 数値にできないオッズの馬は人気の最後にする
+    popularity = np.empty(len(odds), dtype=int)
+    popularity[np.argsort(np.where(np.isnan(odds), np.inf, odds), kind='stable')] = rows + 1
+    odds_text = [f"{value:.1f}" if varies[i] else str(base_odds[i]) for i, value in enumerate(odds)]
+    return list(zip(odds_text, popularity.astype(str)))
+
+
+def write_stand_in_page(prediction_file_path, output_path, change_seconds=5, n_ticks=60):
+    """
+    予測用CSVから、時間とともにオッズが変わるローカルの代替出馬表ページを作る関数
+    netkeibaにアクセスせずにポーリングの動作を確認するために使う
+    各時間帯のオッズと人気は stand_in_odds で求めてページに埋め込み、ページは現在の時間帯の値を表示するだけにする
+    （テストでは同じ関数でページの表示を再現できる）
+
+    Args:
+        prediction_file_path (str): scrape_shutsuba.py で作成した予測用CSVのパス
+        output_path (str): 出力するHTMLファイルのパス
+        change_seconds (int): オッズが変わる間隔（秒）
+        n_ticks (int): 埋め込む時間帯の数（これを超えると最初の時間帯に戻る）
+
+    Returns:
+        str: 代替ページの file:// URL
+    """
+    card_df = pd.read_csv(prediction_file_path, dtype=str).fillna('')
+    first = card_df.iloc[0]
+
+    rows = []
+    for _, horse in card_df.iterrows():
+        horse_weight = horse['馬体重']
+        if horse['馬体重の増減']:
+            horse_weight = f"{horse['馬体重']}({horse['馬体重の増減']})"
+        cells = [
+            horse['枠番'], horse['馬番'], '',
+            f"<span class=\"HorseName\">{html.escape(horse['馬名'])}</span>",
+            '', horse['斤量'], f"<a>{html.escape(horse['騎手'])}</a>", '',
+            horse_weight, horse['オッズ'], horse['人気'],
+        ]
+        rows.append('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>')
+
+    base_odds = card_df['オッズ'].tolist()
+    schedule = [stand_in_odds(base_odds, tick) for tick in range(n_ticks)]
+
+    page = f"""<html><head><meta charset="utf-8"></head><body>
+<div class="RaceName">{html.escape(first['レース名'])}</div>
+<span class="RaceNum">{html.escape(str(first['R']))}</span>
+<div class="RaceData01">天候:{html.escape(first['天気'])} / 馬場:{html.escape(first['馬場'])}</div>
+<div class="RaceData02">{html.escape(str(first['頭数']))}頭</div>
+<table class="RaceTable01"><tr><th>枠</th></tr>
+{chr(10).join(rows)}
+</table>
+<script>
+// {change_seconds}秒ごとに、埋め込んだ時間帯ごとのオッズと人気に表示を切り替える
+var schedule = {json.dumps(schedule)};
+var tick = Math.floor(Date.now() / {change_seconds * 1000}) % schedule.length;
+var rows = document.querySelectorAll('.RaceTable01 tr');
+var k = 0;
+for (var i = 0; i < rows.length; i++) {{
+    var cells = rows[i].getElementsByTagName('td');
+    if (cells.length < 11) {{ continue; }}
+    cells[9].innerText = schedule[tick][k][0];
+    cells[10].innerText = schedule[tick][k][1];
+    k++;
+}}
+</script>
+</body></html>
+"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(page)
+    print(f"代替出馬表ページを '{output_path}' に保存しました。")
+    return 'file://' + os.path.abspath(output_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="出馬表のオッズを定期的に取得し、変わった馬だけを再予測します。")
+    parser.add_argument('url', nargs='?', help="netkeibaの出馬表URL")
+    parser.add_argument('--interval', type=int, default=60, help="ポーリング間隔（秒、デフォルト: 60）")
+    parser.add_argument('--cycles', type=int, default=None, help="ポーリング回数（省略時は Ctrl+C まで）")
+    parser.add_argument('--stand-in', metavar='CSV',
+                        help="予測用CSVからオッズが変動するローカルの代替ページを作り、それをポーリングする")
+    args = parser.parse_args()
+
+    if args.stand_in:
+        stand_in_url = write_stand_in_page(args.stand_in, 'stand_in_shutuba.html')
+        poll_race_odds(stand_in_url, interval=args.interval, cycles=args.cycles)
+    elif args.url:
+        poll_race_odds(args.url, interval=args.interval, cycles=args.cycles)
+    else:
+        print("エラー: 出馬表URLを指定してください。")
+        print("使い方: python poll_odds.py \"https://race.netkeiba.com/race/shutuba.html?race_id=202505021211\" --interval 60")
+        print("動作確認: python poll_odds.py --stand-in \"predict_data_日本ダービー(G1).csv\" --interval 5 --cycles 3")
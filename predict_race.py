@@ -1,52 +1,73 @@
 import pandas as pd
 import joblib
+import time
 import sys
 import os
 
-def predict_race_outcome(prediction_file_path):
+from prediction_cache import PredictionCache, CACHE_DIR
+from feature_contributions import explain_predictions, format_contribution_table
+
+# モデルとエンコーダーのファイルパス
+MODEL_PATH = 'random_forest_model.joblib'
+ENCODERS_PATH = 'label_encoders.joblib'
+
+
+def load_model_and_encoders(model_path=MODEL_PATH, encoders_path=ENCODERS_PATH):
     """
-    学習済みモデルを使い、出馬表データの着順を予測する関数
+    学習済みモデルとエンコーダーを読み込む関数
 
     Args:
-        prediction_file_path (str): 予測したいレースのCSVファイルへのパス
-    """
-    # --- 1. モデルとデータの読み込み ---
-    print("--- 1. モデル、エンコーダー、予測用データの読み込み ---")
-    
-    # モデルとエンコーダーのファイルパス
-    model_path = 'random_forest_model.joblib'
-    encoders_path = 'label_encoders.joblib'
+        model_path (str): 学習済みモデルのファイルパス
+        encoders_path (str): エンコーダーのファイルパス
 
+    Returns:
+        tuple: (model, encoders)。ファイルが存在しない場合は (None, None)
+    """
     # ファイルの存在チェック
     if not os.path.exists(model_path) or not os.path.exists(encoders_path):
         print(f"エラー: '{model_path}' または '{encoders_path}' が見つかりません。")
         print("先に 'train_model.py' を実行して、モデルを学習・保存してください。")
-        return
+        return None, None
 
-    try:
-        model = joblib.load(model_path)
-        encoders = joblib.load(encoders_path)
-        predict_df = pd.read_csv(prediction_file_path)
-        print("モデル、エンコーダー、予測用データの読み込みが完了しました。")
-    except FileNotFoundError:
-        print(f"エラー: 予測用ファイル '{prediction_file_path}' が見つかりません。")
-        return
-    except Exception as e:
-        print(f"ファイルの読み込み中にエラーが発生しました: {e}")
-        return
+    model = joblib.load(model_path)
+    encoders = joblib.load(encoders_path)
+    return model, encoders
 
-    # 馬名を後で使うために保持しておく
-    horse_names = predict_df['馬名']
+
+def is_ranking_model(model):
+    """
+    train_model.py --rank で学習したレース単位の順位付けモデルかどうかを判定する関数
+    順位付けモデルは着順ごとの確率ではなく、レース内で比べるためのスコア（predict_score）を返す
+    """
+    return hasattr(model, 'predict_score')
+
+
+def rank_scores(scores):
+    """
+    スコアを出馬表内の予測順位（スコアが最も大きい馬が1）に変換する関数
+    同じスコアの馬は出馬表の並び順で順位を付けるため、同じ出馬表なら常に同じ順位になる
+    """
+    return pd.Series(scores).rank(ascending=False, method='first').astype(int).to_numpy()
+
+
+def preprocess_predict_data(predict_df, model, encoders):
+    """
+    出馬表データを学習時と同じ形式の特徴量に変換する関数
+
+    Args:
+        predict_df (pd.DataFrame): 出馬表データ（'馬名'列を含む）
+        model: 学習済みモデル（feature_names_in_ を持つもの）
+        encoders (dict): 列名をキーとするLabelEncoderの辞書
+
+    Returns:
+        pd.DataFrame: 学習時と同じ列順の特徴量。列が揃わない場合は None
+    """
     # 予測に使う特徴量のデータフレームをコピー
     X_predict = predict_df.drop('馬名', axis=1).copy()
 
-
-    # --- 2. 予測データの整形と前処理 ---
-    print("\n--- 2. 予測用データの前処理 ---")
-    
-    # 'R'列を数値に変換
-    if 'R' in X_predict.columns and X_predict['R'].dtype == 'object':
-        X_predict['R'] = X_predict['R'].str.replace('R', '').astype(int)
+    # 'R'列の "11R" のような表記から 'R' を取り除く（レース番号が取得できなかった "" は下の変換でNaNになる）
+    if 'R' in X_predict.columns and not pd.api.types.is_numeric_dtype(X_predict['R']):
+        X_predict['R'] = X_predict['R'].astype(str).str.replace('R', '')
 
     # 数値であるべき列を数値型に変換（変換できないものはNaNにする）
     numeric_cols = ['R', '頭数', '枠番', '馬番', 'オッズ', '人気', '斤量', '馬体重', '馬体重の増減']
@@ -54,12 +75,11 @@ def predict_race_outcome(prediction_file_path):
         if col in X_predict.columns:
             X_predict[col] = pd.to_numeric(X_predict[col], errors='coerce')
     
-    # もしNaNがあれば、中央値で補完（学習データがないため暫定的に予測データの中央値を使用）
-    for col in X_predict.columns:
-        if X_predict[col].isnull().any():
-            median_val = X_predict[col].median()
-            X_predict[col].fillna(median_val, inplace=True)
-            print(f"'{col}'列の欠損値を中央値({median_val})で補完しました。")
+    # 欠損値（"計不" の馬体重、"---" のオッズなど）は補完しない
+    # 学習時も欠損値の行を欠損値のまま使っているため、モデルが欠損値の分岐先を学習済み
+    for col in numeric_cols:
+        if col in X_predict.columns and X_predict[col].isnull().any():
+            print(f"'{col}'列の欠損値 {X_predict[col].isnull().sum()}件は欠損値のまま予測します。")
 
     # カテゴリ変数を保存したエンコーダーで数値に変換
     categorical_cols = ['レース名', '天気', '騎手', '馬場']
@@ -82,11 +102,89 @@ def predict_race_outcome(prediction_file_path):
     except Exception as e:
         print(f"エラー: 特徴量の列順を揃える際に問題が発生しました。{e}")
         print("学習時と予測時でCSVの列名が異なっている可能性があります。")
+        return None
+
+    return X_predict
+
+
+def print_contributions(model, X_predict, horse_names, row_order):
+    """
+    各馬の予測を特徴量ごとの寄与度に分解して表示する関数
+
+    Args:
+        model: 学習済みモデル
+        X_predict (pd.DataFrame): preprocess_predict_data が返した特徴量
+        horse_names (pd.Series): 馬名
+        row_order (pd.Index): 表示する馬の順番（予測結果の表と同じ並び）
+    """
+    started_at = time.perf_counter()
+    explanation = explain_predictions(model, X_predict)
+    if explanation is None:
+        print("\nこのモデルは特徴量ごとの寄与度の表示に対応していません。")
+        return
+    bias, contributions = explanation
+    elapsed = time.perf_counter() - started_at
+
+    if is_ranking_model(model):
+        total_label = 'スコア'
+        note = "プラスほど上位方向"
+    else:
+        total_label = '予測着順 (期待値)'
+        note = "マイナスほど上位方向"
+    print(f"\n--- 特徴量ごとの寄与度 (基準値 {bias:.2f} からの増減、{note}、計算 {elapsed * 1000:.1f}ミリ秒) ---")
+    table = format_contribution_table(horse_names, bias, contributions, total_label)
+    formatters = {col: '{:+.2f}'.format for col in contributions.columns}
+    formatters[total_label] = '{:.2f}'.format
+    print(table.loc[row_order].to_string(index=False, formatters=formatters))
+
+
+def predict_race_outcome(prediction_file_path, cache=None):
+    """
+    学習済みモデルを使い、出馬表データの着順を予測する関数
+
+    Args:
+        prediction_file_path (str): 予測したいレースのCSVファイルへのパス
+        cache (PredictionCache): 予測結果のキャッシュ。Noneの場合は毎回予測する
+    """
+    # --- 1. モデルとデータの読み込み ---
+    print("--- 1. モデル、エンコーダー、予測用データの読み込み ---")
+
+    try:
+        model, encoders = load_model_and_encoders()
+        if model is None:
+            return
+        predict_df = pd.read_csv(prediction_file_path)
+        print("モデル、エンコーダー、予測用データの読み込みが完了しました。")
+    except FileNotFoundError:
+        print(f"エラー: 予測用ファイル '{prediction_file_path}' が見つかりません。")
+        return
+    except Exception as e:
+        print(f"ファイルの読み込み中にエラーが発生しました: {e}")
+        return
+
+    # 馬名を後で使うために保持しておく
+    horse_names = predict_df['馬名']
+
+
+    # --- 2. 予測データの整形と前処理 ---
+    print("\n--- 2. 予測用データの前処理 ---")
+    X_predict = preprocess_predict_data(predict_df, model, encoders)
+    if X_predict is None:
         return
     
     # --- 3. 着順の予測 ---
     print("\n--- 3. 着順の予測実行 ---")
-    predictions = model.predict(X_predict)
+    if is_ranking_model(model):
+        # 順位付けモデルは、出馬表全体をまとめてスコア付けし、その順に予測着順とする
+        predictions = rank_scores(model.predict_score(X_predict))
+    elif cache is not None:
+        predictions_proba = cache.predict_proba(model, X_predict)
+        cache.print_stats()
+        predictions = model.classes_[predictions_proba.argmax(axis=1)]
+    else:
+        predictions_proba = model.predict_proba(X_predict)
+        # 最も確率の高い着順（model.predict と同じ結果）
+        predictions = model.classes_[predictions_proba.argmax(axis=1)]
     print("予測が完了しました。")
 
     # --- 4. 結果の表示 ---
@@ -102,12 +200,15 @@ def predict_race_outcome(prediction_file_path):
     # 結果をきれいに表示
     print(results_df_sorted.to_string(index=False))
 
+    # --- 5. 予測の根拠 ---
+    print_contributions(model, X_predict, horse_names, results_df_sorted.index)
+
 
 if __name__ == '__main__':
     # コマンドラインから予測用CSVファイル名を取得
     if len(sys.argv) > 1:
         prediction_csv_file = sys.argv[1]
-        predict_race_outcome(prediction_csv_file)
+        predict_race_outcome(prediction_csv_file, cache=PredictionCache(disk_dir=CACHE_DIR))
     else:
         print("エラー: 予測対象のCSVファイルを指定してください。")
         print("使い方: python predict_race.py 'predict_data_日本ダービー(G1).csv'")
\ No newline at end of file
@@ -0,0 +1,262 @@
+import pandas as pd
+from selenium.webdriver.common.by import By
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
+import time
+import re
+
+from scrape_shutsuba import create_driver, resolve_driver_path, scrape_race_card
+from predict_race import load_model_and_encoders, preprocess_predict_data, is_ranking_model
+from prediction_cache import PredictionCache, CACHE_DIR
+
+# 出馬表ページのURL（race_idを埋め込んで使う）
+SHUTUBA_URL_TEMPLATE = "https://race.netkeiba.com/race/shutuba.html?race_id={race_id}"
+
+
+def extract_race_id(url):
+    """
+    出馬表などのURLからrace_id（12桁）を取り出す関数
+
+    Args:
+        url (str): race_id=... を含むnetkeibaのURL
+
+    Returns:
+        str: race_id。見つからない場合は None
+    """
+    match = re.search(r'race_id=(\d{12})', url)
+    return match.group(1) if match else None
+
+
+def scrape_race_list_urls(index_url, driver):
+    """
+    開催日のレース一覧ページから、その日の全レースの出馬表URLを取得する関数
+
+    Args:
+        index_url (str): netkeibaのレース一覧ページのURL（例: race_list.html?kaisai_date=20250601）
+        driver: 使用するSeleniumのWebDriverインスタンス
+
+    Returns:
+        list: 出馬表URLのリスト（重複なし、ページ上の順番）
+    """
+    try:
+        driver.get(index_url)
+        time.sleep(3)  # レース一覧はJavaScriptで描画されるため待機する
+    except Exception as e:
+        print(f"URLへのアクセスに失敗しました: {index_url} - エラー: {e}")
+        return []
+
+    race_ids = []
+    for link in driver.find_elements(By.XPATH, '//a[contains(@href, "race_id=")]'):
+        race_id = extract_race_id(link.get_attribute('href') or '')
+        if race_id and race_id not in race_ids:
+            race_ids.append(race_id)
+
+    print(f"レース一覧から {len(race_ids)} レースの出馬表URLを取得しました。")
+    return [SHUTUBA_URL_TEMPLATE.format(race_id=race_id) for race_id in race_ids]
+
+
+def dedupe_race_urls(urls):
+    """
+    同じレースを指す出馬表URLを1つにまとめる関数（race_idが同じURL、もしくは全く同じURLを重複とみなす）
+
+    Args:
+        urls (list): 出馬表URLのリスト
+
+    Returns:
+        list: 重複を取り除いた出馬表URLのリスト（最初に現れた順番）
+    """
+    unique_urls = {}
+    for url in urls:
+        race_key = extract_race_id(url) or url
+        if race_key in unique_urls:
+            print(f"同じレースのURLが重複しているためスキップします: {url}")
+            continue
+        unique_urls[race_key] = url
+    return list(unique_urls.values())
+
+
+def scrape_race_cards_concurrently(urls, max_workers=4):
+    """
+    複数の出馬表を並列にスクレイピングする関数
+    スレッドごとにWebDriverを1つ用意し、そのスレッドが担当する出馬表で使い回す
+
+    Args:
+        urls (list): 出馬表URLのリスト
+        max_workers (int): 同時に起動するWebDriverの数
+
+    Returns:
+        list: 各レースの結果を格納した辞書のリスト（urlsと同じ順番）
+              辞書には 'url', 'horses', 'started_at', 'scraped_at' が含まれる
+    """
+    # ChromeDriverのダウンロード・展開は、スレッドを起動する前にメインスレッドで1回だけ行う
+    # （各スレッドで同時に行うと、キャッシュがない場合に同じファイルを並行して展開してしまう）
+    driver_path = resolve_driver_path()
+    local = threading.local()
+    drivers = []
+    drivers_lock = threading.Lock()
+
+    def get_driver():
+        if not hasattr(local, 'driver'):
+            local.driver = create_driver(driver_path)
+            with drivers_lock:
+                drivers.append(local.driver)
+        return local.driver
+
+    def scrape_one(url):
+        started_at = time.perf_counter()
+        try:
+            horses = scrape_race_card(url, None, get_driver())
+        except Exception as e:
+            print(f"出馬表の取得中にエラーが発生しました: {url} - エラー: {e}")
+            horses = []
+        return {
+            'url': url,
+            'horses': horses,
+            'started_at': started_at,
+            'scraped_at': time.perf_counter(),
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(scrape_one, urls))
+    finally:
+        # エラーが発生しても全てのWebDriverを必ず閉じる
+        for driver in drivers:
+            driver.quit()
+
+    return results
+
+
+def predict_race_day(urls, max_workers=4, save_csv=True, cache=None):
+    """
+    複数レースの出馬表をまとめて取得し、1つのモデルで一括して予測する関数
+
+    Args:
+        urls (list): 出馬表URLのリスト
+        max_workers (int): 同時に起動するWebDriverの数
+        save_csv (bool): Trueの場合、各レースの出馬データを predict_data_*.csv として保存する
+        cache (PredictionCache): 予測結果のキャッシュ。Noneの場合は毎回予測する
+
+    Returns:
+        pd.DataFrame: 全レースの予測結果。予測できなかった場合は None
+    """
+    # --- 1. モデルの読み込み（全レースで1回だけ） ---
+    print("--- 1. モデル、エンコーダーの読み込み ---")
+    model, encoders = load_model_and_encoders()
+    if model is None:
+        return None
+    print("モデル、エンコーダーの読み込みが完了しました。")
+
+    # --- 2. 出馬表の並列スクレイピング ---
+    # 同じレースを2回取得・予測しないよう、重複したURLを先に取り除く
+    urls = dedupe_race_urls(urls)
+    print(f"\n--- 2. {len(urls)} レースの出馬表を並列に取得 (同時実行数: {max_workers}) ---")
+    scraped = scrape_race_cards_concurrently(urls, max_workers=max_workers)
+
+    race_frames = []
+    timings = {}
+    for race in scraped:
+        if not race['horses']:
+            print(f"データを取得できなかったためスキップします: {race['url']}")
+            continue
+        race_key = extract_race_id(race['url']) or race['url']
+        race_df = pd.DataFrame(race['horses'])
+
+        if save_csv:
+            safe_race_name = re.sub(r'[\\|/|:|?|.|"|<|>|\|]', '-', race_df['レース名'].iloc[0])
+            output_filename = f"predict_data_{race_key}_{safe_race_name}.csv"
+            race_df.to_csv(output_filename, index=False, encoding='utf-8-sig')
+            print(f"'{output_filename}'に保存しました。")
+
+        race_df.insert(0, 'race_key', race_key)
+        race_frames.append(race_df)
+        timings[race_key] = race
+
+    if not race_frames:
+        print("\nどのレースのデータも取得できませんでした。")
+        return None
+
+    # --- 3. 全レースを1つのバッチとして前処理・予測 ---
+    print("\n--- 3. 全レースを一括で前処理・予測 ---")
+    all_df = pd.concat(race_frames, ignore_index=True)
+    X_predict = preprocess_predict_data(all_df.drop('race_key', axis=1), model, encoders)
+    if X_predict is None:
+        return None
+
+    predict_started_at = time.perf_counter()
+    results_df = pd.DataFrame({
+        'race_key': all_df['race_key'],
+        'レース名': all_df['レース名'],
+        '馬番': all_df['馬番'],
+        '馬名': all_df['馬名'],
+    })
+    if is_ranking_model(model):
+        # 順位付けモデル: 全馬まとめてスコアを求め、レースごとにスコアの大きい順に順位を付ける
+        results_df['スコア'] = model.predict_score(X_predict)
+        results_df['予測着順'] = results_df.groupby('race_key', sort=False)['スコア'].rank(
+            ascending=False, method='first').astype(int)
+        sort_column = '予測着順'
+    else:
+        if cache is not None:
+            predictions_proba = cache.predict_proba(model, X_predict)
+        else:
+            predictions_proba = model.predict_proba(X_predict)
+        results_df['予測着順'] = model.classes_[predictions_proba.argmax(axis=1)]
+        # 期待値 = Σ (着順 * その着順になる確率) を全馬まとめて計算
+        results_df['予測着順 (期待値)'] = predictions_proba @ model.classes_
+        sort_column = '予測着順 (期待値)'
+    predicted_at = time.perf_counter()
+    print(f"{len(all_df)} 頭分の予測が完了しました ({predicted_at - predict_started_at:.3f}秒)。")
+    if cache is not None and not is_ranking_model(model):
+        cache.print_stats()
+
+    # --- 4. 結果の表示 ---
+    print("\n--- ★★★ 最終予測結果 ★★★ ---")
+    pd.options.display.float_format = '{:.2f}'.format
+    for race_key, race_results in results_df.groupby('race_key', sort=False):
+        print(f"\n[{race_key}] {race_results['レース名'].iloc[0]}")
+        race_results_sorted = race_results.sort_values(by=sort_column)
+        print(race_results_sorted.drop(['race_key', 'レース名'], axis=1).to_string(index=False))
+
+    # --- 5. レースごとのレイテンシ ---
+    # 取得時間: 出馬表の取得開始から取得完了まで
+    # 合計時間: 出馬表の取得開始から一括予測の完了まで（発走前に予測が揃うかの目安）
+    print("\n--- レースごとの処理時間 ---")
+    latency_df = pd.DataFrame([
+        {
+            'race_key': race_key,
+            '頭数': len(race['horses']),
+            '取得時間(秒)': race['scraped_at'] - race['started_at'],
+            '合計時間(秒)': predicted_at - race['started_at'],
+        }
+        for race_key, race in timings.items()
+    ])
+    print(latency_df.to_string(index=False))
+
+    return results_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="開催日の全レースの出馬表を取得し、一括で着順を予測します。")
+    parser.add_argument('urls', nargs='*', help="netkeibaの出馬表URL（複数指定可）")
+    parser.add_argument('--index', help="netkeibaのレース一覧ページのURL（例: https://race.netkeiba.com/top/race_list.html?kaisai_date=20250601）")
+    parser.add_argument('--workers', type=int, default=4, help="同時に起動するWebDriverの数（デフォルト: 4）")
+    parser.add_argument('--no-csv', action='store_true', help="各レースの出馬データをCSVに保存しない")
+    args = parser.parse_args()
+
+    race_urls = list(args.urls)
+    if args.index:
+        print("レース一覧ページから出馬表URLを取得しています...")
+        index_driver = create_driver()
+        try:
+            race_urls.extend(scrape_race_list_urls(args.index, index_driver))
+        finally:
+            index_driver.quit()
+
+    if race_urls:
+        predict_race_day(race_urls, max_workers=args.workers, save_csv=not args.no_csv,
+                         cache=PredictionCache(disk_dir=CACHE_DIR))
+    else:
+        print("エラー: 出馬表URLもしくはレース一覧ページのURLを指定してください。")
+        print("使い方: python predict_race_day.py --index \"https://race.netkeiba.com/top/race_list.html?kaisai_date=20250601\"")
@@ -1,30 +1,27 @@
 import pandas as pd
 import numpy as np
-import joblib
 import sys
-import os
 
-def predict_race_expected_value(prediction_file_path):
+from predict_race import (
+    load_model_and_encoders, preprocess_predict_data, is_ranking_model, rank_scores, print_contributions,
+)
+from prediction_cache import PredictionCache, CACHE_DIR
+
+def predict_race_expected_value(prediction_file_path, cache=None):
     """
     学習済みモデルを使い、予測着順の「期待値」を計算する関数
 
     Args:
         prediction_file_path (str): 予測したいレースのCSVファイルへのパス
+        cache (PredictionCache): 予測結果のキャッシュ。Noneの場合は毎回予測する
     """
     # --- 1. モデルとデータの読み込み ---
     print("--- 1. モデル、エンコーダー、予測用データの読み込み ---")
     
-    model_path = 'random_forest_model.joblib'
-    encoders_path = 'label_encoders.joblib'
-
-    if not os.path.exists(model_path) or not os.path.exists(encoders_path):
-        print(f"エラー: '{model_path}' または '{encoders_path}' が見つかりません。")
-        print("先に 'train_model.py' を実行して、モデルを学習・保存してください。")
-        return
-
     try:
-        model = joblib.load(model_path)
-        encoders = joblib.load(encoders_path)
+        model, encoders = load_model_and_encoders()
+        if model is None:
+            return
         predict_df = pd.read_csv(prediction_file_path)
         print("モデル、エンコーダー、予測用データの読み込みが完了しました。")
     except FileNotFoundError:
@@ -35,46 +32,39 @@ def predict_race_expected_value(prediction_file_path):
         return
 
     horse_names = predict_df['馬名']
-    X_predict = predict_df.drop('馬名', axis=1).copy()
 
 
     # --- 2. 予測データの整形と前処理 ---
     print("\n--- 2. 予測用データの前処理 ---")
-    
-    if 'R' in X_predict.columns and X_predict['R'].dtype == 'object':
-        X_predict['R'] = X_predict['R'].str.replace('R', '').astype(int)
-
-    numeric_cols = ['R', '頭数', '枠番', '馬番', 'オッズ', '人気', '斤量', '馬体重', '馬体重の増減']
-    for col in numeric_cols:
-        if col in X_predict.columns:
-            X_predict[col] = pd.to_numeric(X_predict[col], errors='coerce')
-    
-    for col in X_predict.columns:
-        if X_predict[col].isnull().any():
-            median_val = X_predict[col].median()
-            X_predict[col].fillna(median_val, inplace=True)
-            print(f"'{col}'列の欠損値を中央値({median_val})で補完しました。")
-
-    categorical_cols = ['レース名', '天気', '騎手', '馬場']
-    for col in categorical_cols:
-        if col in encoders:
-            le = encoders[col]
-            X_predict[col] = X_predict[col].apply(
-                lambda x: le.transform([x])[0] if x in le.classes_ else -1
-            )
-            print(f"'{col}'列を保存済みルールで数値に変換しました。")
+    X_predict = preprocess_predict_data(predict_df, model, encoders)
+    if X_predict is None:
+        return
 
-    try:
-        X_predict = X_predict[model.feature_names_in_]
-        print("特徴量の列順を学習時と一致させました。")
-    except Exception as e:
-        print(f"エラー: 特徴量の列順を揃える際に問題が発生しました。{e}")
+    # 順位付けモデルは着順ごとの確率を持たないため、期待値の代わりにレース内のスコアと予測順位を表示する
+    if is_ranking_model(model):
+        print("\n--- 3. 出馬表全体のスコアを予測実行 ---")
+        print("順位付けモデルのため、期待値の代わりにスコア（大きいほど上位）を表示します。")
+        scores = model.predict_score(X_predict)
+        results_df = pd.DataFrame({
+            '馬名': horse_names,
+            '予測着順': rank_scores(scores),
+            'スコア': scores,
+        })
+        print("\n--- ★★★ 最終予測結果 (スコア) ★★★ ---")
+        pd.options.display.float_format = '{:.2f}'.format
+        results_df_sorted = results_df.sort_values(by='予測着順')
+        print(results_df_sorted.to_string(index=False))
+        print_contributions(model, X_predict, horse_names, results_df_sorted.index)
         return
-    
+
     # --- 3. 各着順の「確率」を予測 ---
     print("\n--- 3. 各着順の確率を予測実行 ---")
     # model.predict() の代わりに predict_proba() を使用
-    predictions_proba = model.predict_proba(X_predict)
+    if cache is not None:
+        predictions_proba = cache.predict_proba(model, X_predict)
+        cache.print_stats()
+    else:
+        predictions_proba = model.predict_proba(X_predict)
     print("確率の予測が完了しました。")
 
     # --- 4. 確率から期待値を計算 ---
@@ -101,11 +91,14 @@ def predict_race_expected_value(prediction_file_path):
     pd.options.display.float_format = '{:.2f}'.format
     print(results_df_sorted.to_string(index=False))
 
+    # --- 6. 予測の根拠 ---
+    print_contributions(model, X_predict, horse_names, results_df_sorted.index)
+
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
         prediction_csv_file = sys.argv[1]
-        predict_race_expected_value(prediction_csv_file)
+        predict_race_expected_value(prediction_csv_file, cache=PredictionCache(disk_dir=CACHE_DIR))
     else:
         print("エラー: 予測対象のCSVファイルを指定してください。")
         print("使い方: python predict_race_expected.py \"predict_data_日本ダービー(G1).csv\"")
\ No newline at end of file
@@ -0,0 +1,175 @@
+import numpy as np
+from collections import OrderedDict
+import hashlib
+import os
+import shutil
+
+# ディスク上のキャッシュのデフォルトの保存先
+CACHE_DIR = 'prediction_cache'
+
+
+class PredictionCache:
+    """
+    前処理済みの特徴量1行ごとに predict_proba の結果を保存するキャッシュ
+
+    キーは「モデルファイルの内容のハッシュ + 特徴量の行のハッシュ」。
+    メモリ上はLRUで max_entries 件まで保持し、disk_dir を指定するとディスクにも同じくLRUで max_entries 件まで保存する。
+    モデルファイル（random_forest_model.joblib）が更新されると、自動的にキャッシュを破棄する。
+    ディスク上のキャッシュはモデルのバージョンごとのディレクトリに分け、現在のバージョン以外のディレクトリは
+    最初にモデルファイルを確認した時点で削除する（予測スクリプトは実行のたびに新しいプロセスになるため）。
+    """
+
+    def __init__(self, model_path='random_forest_model.joblib', max_entries=10000, disk_dir=None):
+        """
+        Args:
+            model_path (str): キャッシュの対象となる学習済みモデルのファイルパス
+            max_entries (int): メモリ上・ディスク上のそれぞれに保持する最大件数
+            disk_dir (str): ディスク上のキャッシュの保存先。Noneの場合はメモリのみ
+        """
+        self.model_path = model_path
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # ディスク上のキャッシュのキー（古く使われたものから順に並べる）
+        self._disk_keys = OrderedDict()
+        self._file_stamp = None
+        self._model_version = None
+
+    @property
+    def model_version(self):
+        """
+        モデルファイルの内容から求めたバージョン文字列
+        ファイルの更新日時とサイズが変わったときだけ内容のハッシュを計算し直す
+        """
+        stat = os.stat(self.model_path)
+        file_stamp = (stat.st_mtime_ns, stat.st_size)
+        if file_stamp != self._file_stamp:
+            digest = hashlib.sha1()
+            with open(self.model_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            new_version = digest.hexdigest()[:16]
+            if self._model_version is not None and new_version != self._model_version:
+                print("モデルファイルが更新されたため、予測キャッシュを破棄しました。")
+                self._entries.clear()
+            if new_version != self._model_version and self.disk_dir:
+                self._load_disk_keys(new_version)
+            self._file_stamp = file_stamp
+            self._model_version = new_version
+        return self._model_version
+
+    def _load_disk_keys(self, model_version):
+        """
+        現在のバージョン以外のディスク上のキャッシュを削除し、現在のバージョンのキーを最終使用日時の順に読み込む
+        """
+        if os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                path = os.path.join(self.disk_dir, name)
+                if name != model_version and os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+
+        self._disk_keys.clear()
+        version_dir = os.path.join(self.disk_dir, model_version)
+        if os.path.isdir(version_dir):
+            entries = [entry for entry in os.scandir(version_dir) if entry.name.endswith('.npy')]
+            for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime_ns):
+                self._disk_keys[entry.name[:-len('.npy')]] = None
+        self._trim_disk(model_version)
+
+    def _trim_disk(self, model_version):
+        while len(self._disk_keys) > self.max_entries:
+            key, _ = self._disk_keys.popitem(last=False)
+            try:
+                os.remove(self._disk_path(model_version, key))
+            except FileNotFoundError:
+                pass
+
+    def _row_keys(self, X, model_version):
+        values = np.ascontiguousarray(X.to_numpy(dtype=np.float64))
+        prefix = model_version.encode()
+        return [hashlib.sha1(prefix + row.tobytes()).hexdigest() for row in values]
+
+    def _disk_path(self, model_version, key):
+        return os.path.join(self.disk_dir, model_version, f'{key}.npy')
+
+    def _remember(self, key, proba):
+        self._entries[key] = proba
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def predict_proba(self, model, X):
+        """
+        キャッシュに無い行だけを model.predict_proba で計算する関数
+
+        Args:
+            model: 学習済みモデル（model_path から読み込んだもの）
+            X (pd.DataFrame): preprocess_predict_data で前処理済みの特徴量
+
+        Returns:
+            np.ndarray: 各行の着順ごとの確率（model.predict_proba と同じ形）
+        """
+        model_version = self.model_version
+        keys = self._row_keys(X, model_version)
+        results = [None] * len(keys)
+        missing = []
+
+        for i, key in enumerate(keys):
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                results[i] = self._entries[key]
+                self.hits += 1
+            elif key in self._disk_keys:
+                results[i] = np.load(self._disk_path(model_version, key))
+                self._remember(key, results[i])
+                # 最終使用日時を更新し、次回のプロセスでもLRUの順番を引き継ぐ
+                self._disk_keys.move_to_end(key)
+                os.utime(self._disk_path(model_version, key))
+                self.disk_hits += 1
+            else:
+                missing.append(i)
+
+        if missing:
+            # キャッシュに無い行はまとめて1回で予測する
+            self.misses += len(missing)
+            missing_proba = model.predict_proba(X.iloc[missing])
+            if self.disk_dir:
+                os.makedirs(os.path.join(self.disk_dir, model_version), exist_ok=True)
+            for i, proba in zip(missing, missing_proba):
+                results[i] = proba
+                self._remember(keys[i], proba)
+                if self.disk_dir:
+                    np.save(self._disk_path(model_version, keys[i]), proba)
+                    self._disk_keys[keys[i]] = None
+                    self._disk_keys.move_to_end(keys[i])
+            if self.disk_dir:
+                self._trim_disk(model_version)
+
+        if not results:
+            return np.empty((0, len(model.classes_)))
+        return np.vstack(results)
+
+    def stats(self):
+        """
+        キャッシュの利用状況を返す関数
+
+        Returns:
+            dict: ヒット数（メモリ・ディスク）、ミス数、ヒット率、保持件数（メモリ・ディスク）
+        """
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+            'entries': len(self._entries),
+            'disk_entries': len(self._disk_keys),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"予測キャッシュ: ヒット {stats['hits']}件 (ディスク {stats['disk_hits']}件) / "
+              f"ミス {stats['misses']}件 / ヒット率 {stats['hit_rate']:.1%}")
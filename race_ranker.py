@@ -0,0 +1,220 @@
+import numpy as np
+from sklearn.tree import DecisionTreeRegressor
+
+
+def pad_groups(groups):
+    """
+    レースごとの行をまとめて、(レース数, 最大頭数) の行番号の表を作る関数
+    各レースの馬を1行に並べることで、レース単位の計算を配列演算でまとめて行えるようにする
+
+    Args:
+        groups (np.ndarray): 各行が属するレースの番号
+
+    Returns:
+        tuple: (index, mask)
+               index[g, k] はレースgのk頭目の行番号（空き枠は0）、mask は実在する枠だけ True
+    """
+    groups = np.asarray(groups)
+    order = np.argsort(groups, kind='stable')
+    _, group_ids, sizes = np.unique(groups[order], return_inverse=True, return_counts=True)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    slots = np.arange(len(order)) - starts[group_ids]
+
+    index = np.zeros((len(sizes), sizes.max()), dtype=np.int64)
+    mask = np.zeros((len(sizes), sizes.max()), dtype=bool)
+    index[group_ids, slots] = order
+    mask[group_ids, slots] = True
+    return index, mask
+
+
+def finish_gains(finish_positions):
+    """着順から利得を求める（1着が最も大きく、着順が下がるほど小さくなる）"""
+    return 1.0 / np.log2(1.0 + np.asarray(finish_positions, dtype=np.float64))
+
+
+def ndcg_by_race(scores, finish_positions, index, mask):
+    """
+    各レースのNDCG（スコア順に並べたときの着順の当たり具合、1.0が完全一致）を求める関数
+
+    Returns:
+        np.ndarray: レースごとのNDCG
+    """
+    padded_scores = np.where(mask, scores[index], -np.inf)
+    padded_gains = np.where(mask, finish_gains(finish_positions)[index], 0.0)
+    discounts = 1.0 / np.log2(2.0 + np.arange(index.shape[1]))
+
+    predicted_order = np.argsort(-padded_scores, axis=1, kind='stable')
+    dcg = (np.take_along_axis(padded_gains, predicted_order, axis=1) * discounts).sum(axis=1)
+    ideal_dcg = (-np.sort(-padded_gains, axis=1) * discounts).sum(axis=1)
+    return dcg / np.where(ideal_dcg > 0, ideal_dcg, 1.0)
+
+
+class RaceRanker:
+    """
+    レース単位で馬の順位付けを学習するモデル（LambdaMART）
+
+    1本ずつ回帰木を追加する勾配ブースティングで、レース内の2頭ずつの着順の上下関係（ペア）を
+    NDCGの変化量で重み付けした損失を最小化する。ペアの計算は (レース数, 頭数, 頭数) の配列でまとめて行う。
+    各木は一部の行（subsample）で学習し、分岐ごとに一部の特徴量（max_features）だけを調べる。
+    predict_score のスコアが大きいほど上位と予測したことを表す。
+    """
+
+    def __init__(self, n_estimators=100, learning_rate=0.1, max_depth=6, min_samples_leaf=50,
+                 sigma=1.0, max_features='sqrt', subsample=0.5, random_state=42):
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.sigma = sigma
+        self.max_features = max_features
+        self.subsample = subsample
+        self.random_state = random_state
+
+    def _prepare_pairs(self, finish_positions, index, mask):
+        """
+        学習中に変わらないペアの情報を、あらかじめ (レース数, 頭数, 頭数) の配列として求めておく
+        pair_weight[g, i, j] は、レースgで i が j に先着したペアの利得の差をIDCGで割った値（それ以外は0）
+        """
+        padded_finish = np.where(mask, finish_positions[index], np.inf)
+        padded_gains = np.where(mask, finish_gains(finish_positions)[index], 0.0)
+        discounts = 1.0 / np.log2(2.0 + np.arange(index.shape[1]))
+        ideal_dcg = (-np.sort(-padded_gains, axis=1) * discounts).sum(axis=1)
+
+        better = (padded_finish[:, :, None] < padded_finish[:, None, :]) & mask[:, :, None] & mask[:, None, :]
+        gain_diff = np.abs(padded_gains[:, :, None] - padded_gains[:, None, :])
+        pair_weight = np.where(better, gain_diff / np.where(ideal_dcg > 0, ideal_dcg, 1.0)[:, None, None], 0.0)
+        return pair_weight.astype(np.float32)
+
+    def _lambda_gradients(self, scores, pair_weight, index, mask, pair_buffers):
+        """
+        各馬のスコアに対する損失の勾配(lambda)と2階微分を、全レースまとめて求める
+        (レース数, 頭数, 頭数) の計算は、学習の最初に確保した2つの float32 の配列（pair_buffers）の中で行う
+        """
+        delta_ndcg, rho = pair_buffers
+        padded_scores = np.where(mask, scores[index], 0.0).astype(np.float32)
+
+        # 現在のスコアでのレース内の順位と、その順位の割引率
+        current_order = np.argsort(np.where(mask, -padded_scores, np.inf), axis=1, kind='stable')
+        current_rank = np.empty_like(current_order)
+        np.put_along_axis(current_rank, current_order, np.arange(index.shape[1]), axis=1)
+        discounts = (1.0 / np.log2(2.0 + current_rank)).astype(np.float32)
+
+        # i と j を入れ替えたときのNDCGの変化量で重み付けする
+        np.subtract(discounts[:, :, None], discounts[:, None, :], out=delta_ndcg)
+        np.abs(delta_ndcg, out=delta_ndcg)
+        delta_ndcg *= pair_weight
+        # rho = 1 / (1 + exp(sigma * (s_i - s_j)))（差が大きく exp があふれた場合は 0 になる）
+        np.subtract(padded_scores[:, :, None], padded_scores[:, None, :], out=rho)
+        rho *= self.sigma
+        with np.errstate(over='ignore'):
+            np.exp(rho, out=rho)
+        rho += 1.0
+        np.reciprocal(rho, out=rho)
+
+        # pair_lambda = sigma * rho * delta_ndcg（delta_ndcg の配列に上書きする）
+        pair_lambda = delta_ndcg
+        pair_lambda *= rho
+        pair_lambda *= self.sigma
+        # 先着した側はスコアを上げ、負けた側は下げる方向の勾配
+        padded_lambda = pair_lambda.sum(axis=2) - pair_lambda.sum(axis=1)
+
+        # pair_hessian = sigma * (1 - rho) * pair_lambda（rho の配列に上書きする）
+        pair_hessian = rho
+        np.subtract(1.0, rho, out=pair_hessian)
+        pair_hessian *= self.sigma
+        pair_hessian *= pair_lambda
+        padded_hessian = pair_hessian.sum(axis=2) + pair_hessian.sum(axis=1)
+
+        lambdas = np.zeros(len(scores))
+        hessians = np.zeros(len(scores))
+        lambdas[index[mask]] = padded_lambda[mask]
+        hessians[index[mask]] = padded_hessian[mask]
+        return lambdas, hessians
+
+    @staticmethod
+    def _node_sums(tree, leaves, values):
+        """
+        各行の値を、その行が通る全てのノードについて合計する関数
+        葉ごとに合計してから、子ノードの合計を親ノードに足し上げる
+        （sklearn のノード番号は親より子が大きいため、番号の大きい順に処理すれば子が先に確定する）
+        """
+        sums = np.bincount(leaves, weights=values, minlength=tree.tree_.node_count)
+        children_left, children_right = tree.tree_.children_left, tree.tree_.children_right
+        for node in np.flatnonzero(children_left >= 0)[::-1]:
+            sums[node] = sums[children_left[node]] + sums[children_right[node]]
+        return sums
+
+    def fit(self, X, y, groups, eval_set=None):
+        """
+        Args:
+            X (pd.DataFrame): 特徴量
+            y (array-like): 着順（1が1着）
+            groups (array-like): 各行が属するレースの番号
+            eval_set (tuple): (X_val, y_val, groups_val)。指定すると10回ごとに検証データのNDCGを表示する
+        """
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        features = np.ascontiguousarray(X, dtype=np.float32)
+        finish_positions = np.asarray(y, dtype=np.float64)
+        index, mask = pad_groups(groups)
+        pair_weight = self._prepare_pairs(finish_positions, index, mask)
+        pair_buffers = (np.empty_like(pair_weight), np.empty_like(pair_weight))
+        if eval_set is not None:
+            X_val, y_val, groups_val = eval_set
+            val_features = np.ascontiguousarray(X_val, dtype=np.float32)
+            val_finish = np.asarray(y_val, dtype=np.float64)
+            val_index, val_mask = pad_groups(groups_val)
+            val_scores = np.zeros(len(val_features))
+
+        rng = np.random.RandomState(self.random_state)
+        n_rows = len(features)
+        n_subsample = max(1, int(round(n_rows * self.subsample)))
+        # 各木の学習に使う行は、毎回同じ配列に取り出す
+        subsample_features = np.empty((n_subsample, features.shape[1]), dtype=np.float32)
+        scores = np.zeros(n_rows)
+        self.estimators_ = []
+        for iteration in range(self.n_estimators):
+            lambdas, hessians = self._lambda_gradients(scores, pair_weight, index, mask, pair_buffers)
+            tree = DecisionTreeRegressor(
+                max_depth=self.max_depth, min_samples_leaf=self.min_samples_leaf, max_features=self.max_features,
+                random_state=rng.randint(np.iinfo(np.int32).max),
+            )
+            if n_subsample < n_rows:
+                rows = np.sort(rng.choice(n_rows, n_subsample, replace=False))
+                np.take(features, rows, axis=0, out=subsample_features)
+                tree.fit(subsample_features, lambdas[rows])
+            else:
+                tree.fit(features, lambdas)
+
+            # ノードの値を、全ての行を使ったニュートン法の1ステップ (Σlambda / Σhessian) に置き換える
+            # 予測に使うのは葉の値だけだが、寄与度の分解（feature_contributions.py）のために途中のノードにも
+            # そのノードを通る行の値を入れておく。行がたどる葉は予測時と同じ apply で求める
+            leaves = tree.apply(features)
+            node_lambda = self._node_sums(tree, leaves, lambdas)
+            node_hessian = self._node_sums(tree, leaves, hessians)
+            tree.tree_.value[:, 0, 0] = node_lambda / np.where(node_hessian > 0, node_hessian, 1.0)
+
+            scores += self.learning_rate * tree.tree_.value[leaves, 0, 0]
+            self.estimators_.append(tree)
+
+            if eval_set is not None:
+                val_scores += self.learning_rate * tree.predict(val_features)
+                if (iteration + 1) % 10 == 0:
+                    val_ndcg = ndcg_by_race(val_scores, val_finish, val_index, val_mask).mean()
+                    print(f"  {iteration + 1}本目: 検証データのNDCG {val_ndcg:.4f}")
+        return self
+
+    def predict_score(self, X):
+        """
+        各馬のスコアを返す関数（同じレースの中で、スコアが大きいほど上位と予測）
+
+        Args:
+            X (pd.DataFrame): 学習時と同じ列順の特徴量
+
+        Returns:
+            np.ndarray: 各行のスコア
+        """
+        features = np.ascontiguousarray(X, dtype=np.float32)
+        scores = np.zeros(len(features))
+        for tree in self.estimators_:
+            scores += self.learning_rate * tree.predict(features)
+        return scores
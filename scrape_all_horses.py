@@ -5,8 +5,23 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import NoSuchElementException
 import time
-import re
+import sys
 import os # osライブラリをインポート
+import re
+
+from normalize_race_data import assign_horse_weights, RACE_ID_COL
+
+def extract_result_race_id(race_link):
+    """
+    戦績テーブルのレース名のリンク（例: https://db.netkeiba.com/race/202505021211/）からrace_idを取り出す関数
+    同じ名前のレースでも開催年・開催日ごとに異なるため、同じレースの出走馬をまとめるキーになる
+
+    Returns:
+        str: race_id。リンクに含まれていない場合は空文字
+    """
+    match = re.search(r'/race/(\d{12})', race_link or '')
+    return match.group(1) if match else ''
+
 
 def scrape_horse_race_data(url, driver):
     """
@@ -33,7 +48,8 @@ def scrape_horse_race_data(url, driver):
 
     for i, row in enumerate(rows):
         try:
-            race_name = row.find_element(By.XPATH, './td[5]/a').text.strip()
+            race_link = row.find_element(By.XPATH, './td[5]/a')
+            race_name = race_link.text.strip()
             weather = row.find_element(By.XPATH, './td[3]').text.strip()
             round_num_text = row.find_element(By.XPATH, './td[4]').text.strip()
             num_horses = row.find_element(By.XPATH, './td[7]').text.strip()
@@ -45,18 +61,9 @@ def scrape_horse_race_data(url, driver):
             jockey = row.find_element(By.XPATH, './td[13]/a').text.strip()
             kinryo = row.find_element(By.XPATH, './td[14]').text.strip()
             baba_condition = row.find_element(By.XPATH, './td[16]').text.strip()
+            # 馬体重は "480(+4)" のまま取得し、体重と増減への分割は全レース分まとめて行う
             horse_weight_full = row.find_element(By.XPATH, './td[24]').text.strip()
 
-            horse_weight = ""
-            horse_weight_diff = ""
-            match = re.match(r'(\d+)\((.*?)\)', horse_weight_full)
-            if match:
-                horse_weight = match.group(1)
-                horse_weight_diff = match.group(2)
-            elif horse_weight_full.isdigit():
-                horse_weight = horse_weight_full
-                horse_weight_diff = "0"
-
             race_info = {
                 "レース名": race_name,
                 "天気": weather,
@@ -70,8 +77,9 @@ def scrape_horse_race_data(url, driver):
                 "騎手": jockey,
                 "斤量": kinryo,
                 "馬場": baba_condition,
-                "馬体重": horse_weight,
-                "馬体重の増減": horse_weight_diff,
+                "馬体重": horse_weight_full,
+                "馬体重の増減": "",
+                RACE_ID_COL: extract_result_race_id(race_link.get_attribute('href')),
             }
             race_data_list.append(race_info)
 
@@ -81,16 +89,20 @@ def scrape_horse_race_data(url, driver):
             print(f"  > 行 {i+1} でデータ抽出エラー: {e}")
             continue
 
+    # 馬体重の文字列を全レース分まとめて体重と増減に分ける
+    assign_horse_weights(race_data_list)
     return race_data_list
 
 if __name__ == '__main__':
     # URLリストをファイルから読み込む
+    # horse_url.py が書き出した新しい馬だけのリスト（horse_urls_new.txt）を指定すると、その馬だけを取得する
+    url_list_path = sys.argv[1] if len(sys.argv) > 1 else 'horse_urls_all_pages.txt'
     try:
-        with open('horse_urls_all_pages.txt', 'r', encoding='utf-8') as f:
+        with open(url_list_path, 'r', encoding='utf-8') as f:
             urls = [line.strip() for line in f if line.strip()]
         print(f"ファイルから {len(urls)} 件のURLを読み込みました。")
     except FileNotFoundError:
-        print("エラー: horse_urls_all_pages.txt が見つかりません。")
+        print(f"エラー: {url_list_path} が見つかりません。")
         exit()
         
     output_filename = "all_horses_race_data_appended.csv"
@@ -99,7 +111,7 @@ if __name__ == '__main__':
     column_order = [
         "レース名", "天気", "R", "頭数", "枠番", "馬番", 
         "オッズ", "人気", "着順", "騎手", "斤量", "馬場", 
-        "馬体重", "馬体重の増減"
+        "馬体重", "馬体重の増減", RACE_ID_COL
     ]
 
     # --- 変更点 ---
@@ -107,6 +119,13 @@ if __name__ == '__main__':
     if not os.path.exists(output_filename):
         pd.DataFrame(columns=column_order).to_csv(output_filename, index=False, encoding='utf-8-sig')
         print(f"'{output_filename}'を新規作成しました。")
+    else:
+        # race_id の列を追加する前に作ったファイルには、既存の列だけを追記する（列がずれないようにする）
+        existing_columns = pd.read_csv(output_filename, nrows=0, encoding='utf-8-sig').columns.tolist()
+        if RACE_ID_COL not in existing_columns:
+            column_order = [col for col in column_order if col != RACE_ID_COL]
+            print(f"'{output_filename}'には{RACE_ID_COL}の列がないため、{RACE_ID_COL}は保存しません。"
+                  "レース単位の学習（train_model.py --rank）にはファイルを作り直してください。")
     # --- 変更点ここまで ---
 
     # Chromeドライバーのセットアップ
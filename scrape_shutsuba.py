@@ -7,13 +7,104 @@ from selenium.common.exceptions import NoSuchElementException
 import time
 import re
 
+from normalize_race_data import assign_horse_weights
+
+# レース名のグレードアイコンのclass名と、学習データ上の表記の対応
+GRADE_ICON_SUFFIXES = {
+    'Icon_GradeType1': '(G1)',
+    'Icon_GradeType2': '(G2)',
+    'Icon_GradeType3': '(G3)',
+}
+
+
+def resolve_driver_path():
+    """
+    ChromeDriverのパスを取得する関数（キャッシュにない場合はダウンロードして展開する）
+    複数のWebDriverを並列に起動する場合は、先にこの関数を1回だけ呼び、結果を create_driver に渡す
+    """
+    return ChromeDriverManager().install()
+
+
+def create_driver(driver_path=None):
+    """
+    ヘッドレスモードのChrome WebDriverを初期化する関数
+
+    Args:
+        driver_path (str): resolve_driver_path で取得したChromeDriverのパス。Noneの場合はここで取得する
+
+    Returns:
+        WebDriver: 初期化済みのSeleniumのWebDriverインスタンス
+    """
+    service = Service(driver_path or resolve_driver_path())
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('window-size=1920x1080')
+    return webdriver.Chrome(service=service, options=options)
+
+
+def scrape_race_common_data(driver):
+    """
+    読み込み済みの出馬表ページから全馬共通のレース情報を取得する関数
+
+    Args:
+        driver: 出馬表ページを読み込み済みのSeleniumのWebDriverインスタンス
+
+    Returns:
+        dict: レース名・天気・R・頭数・馬場を格納した辞書。取得できなかった項目は空文字
+    """
+    common_data = {"レース名": "", "天気": "", "R": "", "頭数": "", "馬場": ""}
+
+    try:
+        race_name_element = driver.find_element(By.CLASS_NAME, 'RaceName')
+        race_name = race_name_element.text.strip()
+        # 重賞はグレードがアイコン画像で表示されるため、学習データの表記 "(G1)" に合わせて付与する
+        for icon in race_name_element.find_elements(By.TAG_NAME, 'span'):
+            icon_classes = (icon.get_attribute('class') or '').split()
+            for icon_class, suffix in GRADE_ICON_SUFFIXES.items():
+                if icon_class in icon_classes:
+                    race_name += suffix
+        common_data["レース名"] = race_name
+    except NoSuchElementException:
+        print("レース名が見つかりませんでした。")
+
+    try:
+        common_data["R"] = driver.find_element(By.CLASS_NAME, 'RaceNum').text.strip()
+    except NoSuchElementException:
+        print("レース番号が見つかりませんでした。")
+
+    # "15:40発走 / 芝2400m (左 A) / 天候:晴 / 馬場:良" のような形式
+    try:
+        race_data_01 = driver.find_element(By.CLASS_NAME, 'RaceData01').text
+        weather_match = re.search(r'天候\s*:\s*(\S+)', race_data_01)
+        if weather_match:
+            common_data["天気"] = weather_match.group(1)
+        track_match = re.search(r'馬場\s*:\s*(\S+)', race_data_01)
+        if track_match:
+            common_data["馬場"] = track_match.group(1)
+    except NoSuchElementException:
+        print("天候・馬場の情報が見つかりませんでした。")
+
+    # "... 18頭 ..." のような形式
+    try:
+        race_data_02 = driver.find_element(By.CLASS_NAME, 'RaceData02').text
+        num_horses_match = re.search(r'(\d+)頭', race_data_02)
+        if num_horses_match:
+            common_data["頭数"] = num_horses_match.group(1)
+    except NoSuchElementException:
+        print("頭数の情報が見つかりませんでした。")
+
+    return common_data
+
+
 def scrape_race_card(url, common_data, driver):
     """
     指定されたURLの出馬表から各馬の情報をスクレイピングする関数
 
     Args:
         url (str): netkeibaの出馬表ページのURL
-        common_data (dict): 全馬共通のレース情報
+        common_data (dict): 全馬共通のレース情報。Noneの場合はページから取得する
         driver: 使用するSeleniumのWebDriverインスタンス
 
     Returns:
@@ -26,6 +117,9 @@ def scrape_race_card(url, common_data, driver):
         print(f"URLへのアクセスに失敗しました: {url} - エラー: {e}")
         return []
 
+    if common_data is None:
+        common_data = scrape_race_common_data(driver)
+
     horse_data_list = []
 
     try:
@@ -58,21 +152,8 @@ def scrape_race_card(url, common_data, driver):
             odds = cells[9].text.strip()
             popularity = cells[10].text.strip()
             
-            # 馬体重と増減の処理
+            # 馬体重は "480(+4)" のまま取得し、体重と増減への分割は全頭まとめて行う
             horse_weight_full = cells[8].text.strip()
-            horse_weight = ""
-            horse_weight_diff = ""
-            # 正規表現で "体重(増減)" の形を抽出
-            match = re.match(r'(\d+)\((.+)\)', horse_weight_full)
-            if match:
-                horse_weight = match.group(1)
-                horse_weight_diff = match.group(2)
-            elif horse_weight_full.isdigit(): # 増減がない場合
-                horse_weight = horse_weight_full
-                horse_weight_diff = "0"
-            else: # "--"などの場合
-                horse_weight = "計不" # 計測不能
-                horse_weight_diff = ""
 
             # 1頭分のデータを辞書にまとめる
             horse_info = {
@@ -88,8 +169,8 @@ def scrape_race_card(url, common_data, driver):
                 "人気": popularity,
                 "騎手": jockey,
                 "斤量": kinryo,
-                "馬体重": horse_weight,
-                "馬体重の増減": horse_weight_diff,
+                "馬体重": horse_weight_full,
+                "馬体重の増減": "",
             }
             horse_data_list.append(horse_info)
             print(f"  > 取得成功: {uma_ban}番 {horse_name}")
@@ -98,7 +179,15 @@ def scrape_race_card(url, common_data, driver):
             # 広告行などでエラーが出てもスキップして処理を続ける
             # print(f"  > 行 {i+1} でデータ抽出エラー: {e}。この行をスキップします。")
             continue
-            
+
+    # 馬体重の文字列を全頭まとめて体重と増減に分ける（"計不" などは欠損値になる）
+    assign_horse_weights(horse_data_list)
+
+    # 頭数がページから取得できなかった場合は、取得できた馬の数で補う
+    if not common_data["頭数"]:
+        for horse_info in horse_data_list:
+            horse_info["頭数"] = str(len(horse_data_list))
+
     return horse_data_list
 
 if __name__ == '__main__':
@@ -121,13 +210,7 @@ if __name__ == '__main__':
 
     # 2. WebDriverのセットアップ
     print("\nWebDriverを初期化しています...")
-    service = Service(ChromeDriverManager().install())
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    options.add_argument('window-size=1920x1080')
-    driver = webdriver.Chrome(service=service, options=options)
+    driver = create_driver()
 
     # 3. スクレイピングの実行
     all_horse_data = scrape_race_card(race_url, common_race_data, driver)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from feature_contributions import explain_predictions, routed_paths, tree_contributions
+from race_ranker import RaceRanker
+
+
+def make_races(n_races=150, n_horses=12, missing_rate=0.1):
+    """一部の値が欠損した特徴量と着順を作る（オッズが低いほど上位になりやすい）"""
+    rng = np.random.RandomState(0)
+    n_rows = n_races * n_horses
+    X = pd.DataFrame({
+        'オッズ': rng.gamma(1.5, 10.0, n_rows) + 1.0,
+        '斤量': rng.choice([54, 55, 56, 57, 58], n_rows).astype(float),
+        '馬体重': rng.randint(420, 540, n_rows).astype(float),
+        '馬体重の増減': rng.randint(-8, 9, n_rows).astype(float),
+    })
+    noise = X['オッズ'].to_numpy() + rng.normal(0, 5, n_rows)
+    groups = np.repeat(np.arange(n_races), n_horses)
+    finish = pd.Series(noise).groupby(groups).rank(method='first').astype(int).to_numpy()
+    # 欠損値の分岐先を学習させるため、オッズと馬体重の一部を欠損値にする
+    for col in ['オッズ', '馬体重']:
+        X.loc[rng.rand(n_rows) < missing_rate, col] = np.nan
+    return X, finish, groups
+
+
+@pytest.mark.parametrize('missing_rate', [0.0, 0.1])
+@pytest.mark.parametrize('max_leaf_nodes', [None, 64])
+def test_forest_contributions_add_up_to_predict_proba(max_leaf_nodes, missing_rate):
+    X, finish, _ = make_races(missing_rate=missing_rate)
+    model = RandomForestClassifier(n_estimators=10, max_depth=8, max_leaf_nodes=max_leaf_nodes,
+                                   random_state=0).fit(X, finish)
+    # 欠損値がある場合は、欠損値を含む行（予測と同じ分岐先をたどる経路）を確かめる
+    X_card = X[X.isna().any(axis=1)].head(50) if missing_rate else X.head(50)
+
+    bias, contributions = tree_contributions(model, X_card)
+    np.testing.assert_allclose(bias + contributions.sum(axis=1), model.predict_proba(X_card), atol=1e-9)
+
+    # 期待値への寄与の和は、確率から求めた予測着順の期待値と一致する
+    bias, contributions = explain_predictions(model, X_card)
+    np.testing.assert_allclose(bias + contributions.sum(axis=1), model.predict_proba(X_card) @ model.classes_)
+
+
+@pytest.mark.parametrize('missing_rate', [0.0, 0.1])
+def test_ranker_contributions_add_up_to_predict_score(missing_rate):
+    X, finish, groups = make_races(missing_rate=missing_rate)
+    model = RaceRanker(n_estimators=10, max_depth=4, min_samples_leaf=20).fit(X, finish, groups)
+    X_card = X[X.isna().any(axis=1)].head(50) if missing_rate else X.head(50)
+
+    bias, contributions = explain_predictions(model, X_card)
+    np.testing.assert_allclose(bias + contributions.sum(axis=1), model.predict_score(X_card), atol=1e-9)
+
+
+def test_routed_paths_end_at_apply_leaves():
+    X, finish, _ = make_races()
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, finish)
+    features = np.ascontiguousarray(X.head(200), dtype=np.float32)
+
+    trees = [tree.tree_ for tree in model.estimators_]
+    for tree, (path_nodes, path_lengths) in zip(trees, routed_paths(trees, features)):
+        # 各行の経路は根から始まり、予測（apply）と同じ葉で終わる
+        path_ends = np.cumsum(path_lengths)
+        np.testing.assert_array_equal(path_nodes[path_ends - path_lengths], 0)
+        np.testing.assert_array_equal(path_nodes[path_ends - 1], tree.apply(features))
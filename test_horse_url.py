@@ -0,0 +1,95 @@
+import horse_url
+from horse_frontier import HORSE_URL_TEMPLATE, HorseFrontier
+
+PRIZE_QUERY = horse_url.with_sort(horse_url.BASE_QUERY_URL, horse_url.PRIZE_SORT)
+NEWEST_QUERY = horse_url.with_sort(horse_url.BASE_QUERY_URL, horse_url.NEWEST_FIRST_SORT)
+
+
+class FakeElement:
+    def __init__(self, href=None, children=()):
+        self.href = href
+        self.children = list(children)
+
+    def find_element(self, by, value):
+        return self.children[0] if value == './td[2]/a' else self
+
+    def find_elements(self, by, value):
+        return self.children
+
+    def get_attribute(self, name):
+        return self.href
+
+
+class FakeDriver:
+    """page=N ごとに決まった馬IDの一覧を返す馬リストの代わり"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.visited = []
+        self.table = FakeElement()
+
+    def get(self, url):
+        self.visited.append(url)
+        page_num = int(url.split('&page=')[1]) if '&page=' in url else 1
+        ids = self.pages.get(page_num, [])
+        self.table = FakeElement(children=[
+            FakeElement(children=[FakeElement(href=HORSE_URL_TEMPLATE.format(horse_id=horse_id))]) for horse_id in ids
+        ])
+
+    def find_element(self, by, value):
+        return self.table
+
+    def quit(self):
+        pass
+
+
+def run_discovery(tmp_path, monkeypatch, query_url, pages, known_ids, known_pages_to_stop=1):
+    frontier_path = tmp_path / 'horse_urls_all_pages.txt'
+    frontier_path.write_text(''.join(HORSE_URL_TEMPLATE.format(horse_id=i) + '\n' for i in known_ids), encoding='utf-8')
+    driver = FakeDriver(pages)
+    monkeypatch.setattr(horse_url, 'create_driver', lambda: driver)
+    monkeypatch.setattr(horse_url.time, 'sleep', lambda seconds: None)
+    new_urls = horse_url.discover_new_horses([query_url], max_page=5, known_pages_to_stop=known_pages_to_stop,
+                                             frontier_path=frontier_path, delta_path=tmp_path / 'horse_urls_new.txt')
+    return new_urls, driver, HorseFrontier(frontier_path)
+
+
+def test_default_query_lists_newest_horses_first():
+    # 既定の検索条件は、既知の馬だけのページで巡回を打ち切ってよい新しい馬順
+    assert NEWEST_QUERY.endswith(f'&sort={horse_url.NEWEST_FIRST_SORT}')
+    assert '&sort=prize' not in NEWEST_QUERY
+    assert horse_url.lists_newest_first(NEWEST_QUERY)
+    assert not horse_url.lists_newest_first(PRIZE_QUERY)
+    # 並び順以外の検索条件はそのまま残る
+    assert horse_url.with_sort(PRIZE_QUERY, horse_url.NEWEST_FIRST_SORT) == NEWEST_QUERY
+
+
+def test_newest_first_query_stops_at_first_known_page(tmp_path, monkeypatch):
+    pages = {1: ['new1', 'a1'], 2: ['a2', 'b1'], 3: ['new2']}
+    new_urls, driver, frontier = run_discovery(tmp_path, monkeypatch, NEWEST_QUERY, pages, known_ids=['a1', 'a2', 'b1'])
+
+    assert new_urls == [HORSE_URL_TEMPLATE.format(horse_id='new1')]
+    assert 'new1' in frontier
+    assert len(driver.visited) == 2
+
+
+def test_prize_full_crawl_reaches_new_low_prize_horses(tmp_path, monkeypatch):
+    # 1・2ページ目は賞金の多い既知の馬だけで、新しく登録された馬は3ページ目にいる
+    pages = {1: ['a1', 'a2'], 2: ['b1', 'b2'], 3: ['b3', 'new1', 'new2']}
+    new_urls, driver, frontier = run_discovery(tmp_path, monkeypatch, PRIZE_QUERY, pages,
+                                               known_ids=['a1', 'a2', 'b1', 'b2', 'b3'], known_pages_to_stop=None)
+
+    assert new_urls == [HORSE_URL_TEMPLATE.format(horse_id=i) for i in ['new1', 'new2']]
+    assert 'new1' in frontier and 'new2' in frontier
+    # 空のページ（4ページ目）で巡回を終える
+    assert len(driver.visited) == 4
+
+
+def test_early_stop_on_prize_query_warns(tmp_path, monkeypatch, capsys):
+    pages = {1: ['a1', 'a2'], 2: ['new1']}
+    new_urls, driver, _ = run_discovery(tmp_path, monkeypatch, PRIZE_QUERY, pages, known_ids=['a1', 'a2'])
+
+    # 打ち切りは指定どおりに行い、新しい馬を見落とす可能性を警告する
+    assert new_urls == []
+    assert len(driver.visited) == 1
+    assert '警告' in capsys.readouterr().out
@@ -0,0 +1,139 @@
+import json
+import re
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder
+
+from poll_odds import rescore_changed_horses, scrape_odds_snapshot, stand_in_odds, write_stand_in_page
+from predict_race import preprocess_predict_data
+from prediction_cache import PredictionCache
+
+N_HORSES = 14
+
+
+def make_card(path):
+    """出馬表と同じ列の予測用CSVを作る"""
+    rng = np.random.RandomState(0)
+    card = pd.DataFrame({
+        'レース名': 'テストステークス(G3)',
+        '天気': '晴',
+        'R': '11',
+        '頭数': str(N_HORSES),
+        '枠番': [str(i // 2 + 1) for i in range(N_HORSES)],
+        '馬名': [f'馬{i}' for i in range(N_HORSES)],
+        '馬番': [str(i + 1) for i in range(N_HORSES)],
+        'オッズ': [f'{odds:.1f}' for odds in rng.gamma(1.5, 10.0, N_HORSES) + 1.5],
+        '人気': '',
+        '騎手': [f'騎手{i % 5}' for i in range(N_HORSES)],
+        '斤量': '57',
+        '馬場': '良',
+        '馬体重': [str(weight) for weight in rng.randint(420, 540, N_HORSES)],
+        '馬体重の増減': [str(diff) for diff in rng.randint(-8, 9, N_HORSES)],
+    })
+    card['人気'] = (card['オッズ'].astype(float).rank(method='first').astype(int)).astype(str)
+    card.to_csv(path, index=False)
+    return card
+
+
+def train_model(card, model_path):
+    """出馬表と同じ特徴量の列で小さなフォレストを学習し、エンコーダーと一緒に返す"""
+    encoders = {}
+    for col in ['レース名', '天気', '騎手', '馬場']:
+        encoders[col] = LabelEncoder().fit(card[col])
+
+    rng = np.random.RandomState(1)
+    n_rows = 2000
+    X = pd.DataFrame({
+        'レース名': rng.randint(0, len(encoders['レース名'].classes_), n_rows),
+        '天気': rng.randint(0, len(encoders['天気'].classes_), n_rows),
+        'R': rng.randint(1, 13, n_rows),
+        '頭数': rng.randint(8, 19, n_rows),
+        '枠番': rng.randint(1, 9, n_rows),
+        '馬番': rng.randint(1, 19, n_rows),
+        'オッズ': rng.gamma(1.5, 10.0, n_rows) + 1.0,
+        '人気': rng.randint(1, 19, n_rows),
+        '騎手': rng.randint(0, len(encoders['騎手'].classes_), n_rows),
+        '斤量': rng.choice([54, 55, 56, 57, 58], n_rows),
+        '馬場': rng.randint(0, len(encoders['馬場'].classes_), n_rows),
+        '馬体重': rng.randint(420, 540, n_rows),
+        '馬体重の増減': rng.randint(-8, 9, n_rows),
+    })
+    # オッズが低いほど上位になりやすい着順
+    y = np.clip((np.log(X['オッズ']) * 4 + rng.normal(0, 2, n_rows)).round(), 1, 18).astype(int)
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0).fit(X, y)
+    joblib.dump(model, model_path)
+    return model, encoders
+
+
+class StandInDriver:
+    """代替出馬表ページに埋め込まれた時間帯ごとのオッズを、指定した時間帯のページとして返すWebDriverの代わり"""
+
+    def __init__(self, page_path):
+        with open(page_path, encoding='utf-8') as f:
+            page = f.read()
+        self.schedule = json.loads(re.search(r'var schedule = (.*);', page).group(1))
+        self.uma_bans = re.findall(r'<tr><td>[^<]*</td><td>([^<]*)</td>', page)
+        self.tick = 0
+
+    def execute_script(self, script):
+        values = self.schedule[self.tick % len(self.schedule)]
+        return [[uma_ban, odds, popularity] for uma_ban, (odds, popularity) in zip(self.uma_bans, values)]
+
+
+def test_stand_in_page_embeds_stand_in_odds(tmp_path):
+    card = make_card(tmp_path / 'card.csv')
+    write_stand_in_page(tmp_path / 'card.csv', tmp_path / 'stand_in.html', n_ticks=6)
+    driver = StandInDriver(tmp_path / 'stand_in.html')
+
+    assert driver.uma_bans == card['馬番'].tolist()
+    for tick in range(6):
+        driver.tick = tick
+        expected = dict(zip(card['馬番'], stand_in_odds(card['オッズ'].tolist(), tick)))
+        assert scrape_odds_snapshot(driver) == expected
+
+
+def test_only_changed_horses_are_rescored(tmp_path):
+    card = make_card(tmp_path / 'card.csv')
+    model, encoders = train_model(card, tmp_path / 'model.joblib')
+    write_stand_in_page(tmp_path / 'card.csv', tmp_path / 'stand_in.html')
+    driver = StandInDriver(tmp_path / 'stand_in.html')
+
+    # poll_race_odds と同じく、最初の出馬表で全頭を予測する
+    card_df = pd.read_csv(tmp_path / 'card.csv', dtype=str)
+    X_current = preprocess_predict_data(card_df, model, encoders)
+    cache = PredictionCache(model_path=tmp_path / 'model.joblib')
+    predictions_proba = cache.predict_proba(model, X_current)
+    row_positions = {uma_ban: i for i, uma_ban in enumerate(card_df['馬番'])}
+
+    driver.tick = 0
+    previous_snapshot = scrape_odds_snapshot(driver)
+    rescore_changed_horses(model, cache, X_current, predictions_proba, row_positions, {}, previous_snapshot)
+
+    # 時間帯をまたいで2回目のスナップショットを取り、変わった馬だけが再予測されることを確かめる
+    driver.tick = 1
+    current_snapshot = scrape_odds_snapshot(driver)
+    expected_changed = [u for u in current_snapshot if current_snapshot[u] != previous_snapshot[u]]
+    assert 0 < len(expected_changed) < N_HORSES
+
+    # 再予測に渡された行を記録する（オッズが元の値に戻った馬はキャッシュから返るため、モデルではなくキャッシュの呼び出しを見る）
+    scored_rows = []
+    original_predict_proba = cache.predict_proba
+    cache.predict_proba = lambda model, X: scored_rows.extend(X.index) or original_predict_proba(model, X)
+    before = predictions_proba.copy()
+    changed = rescore_changed_horses(model, cache, X_current, predictions_proba, row_positions,
+                                     dict(previous_snapshot), current_snapshot)
+
+    assert changed == expected_changed
+    changed_positions = [row_positions[u] for u in changed]
+    assert sorted(scored_rows) == sorted(X_current.index[changed_positions])
+    unchanged = np.setdiff1d(np.arange(N_HORSES), changed_positions)
+    np.testing.assert_array_equal(predictions_proba[unchanged], before[unchanged])
+
+    # 部分的に更新した確率表は、今回のオッズの出馬表を全頭予測し直した結果と一致する
+    card_df['オッズ'] = [current_snapshot[u][0] for u in card_df['馬番']]
+    card_df['人気'] = [current_snapshot[u][1] for u in card_df['馬番']]
+    X_full = preprocess_predict_data(card_df, model, encoders)
+    np.testing.assert_allclose(predictions_proba, model.predict_proba(X_full))
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder
+
+from predict_race import preprocess_predict_data
+from predict_race_day import dedupe_race_urls
+
+
+def make_card(race_num):
+    """レース番号の列だけを指定した出馬表データを作る"""
+    return pd.DataFrame({
+        'レース名': 'テストステークス(G3)',
+        '天気': '晴',
+        'R': race_num,
+        '頭数': '3',
+        '枠番': ['1', '2', '3'],
+        '馬名': ['馬0', '馬1', '馬2'],
+        '馬番': ['1', '2', '3'],
+        'オッズ': ['2.5', '---', '12.0'],
+        '人気': ['1', '', '2'],
+        '騎手': ['騎手0', '騎手1', '騎手2'],
+        '斤量': '57',
+        '馬場': '良',
+        '馬体重': ['480', '計不', '502'],
+        '馬体重の増減': ['2', '', '-4'],
+    })
+
+
+def make_model(card):
+    """出馬表と同じ列で小さなフォレストを学習し、エンコーダーと一緒に返す"""
+    encoders = {col: LabelEncoder().fit(card[col]) for col in ['レース名', '天気', '騎手', '馬場']}
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame(rng.randint(0, 3, (60, 13)), columns=card.columns.drop('馬名'))
+    y = rng.randint(1, 4, 60)
+    return RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y), encoders
+
+
+def test_missing_race_number_is_predicted_as_missing_value():
+    model, encoders = make_model(make_card('11R'))
+
+    X_numbered = preprocess_predict_data(make_card('11R'), model, encoders)
+    assert (X_numbered['R'] == 11).all()
+
+    # レース番号が取得できなかった出馬表（R=""）も、例外にならずに欠損値のまま予測できる
+    X_missing = preprocess_predict_data(make_card(''), model, encoders)
+    assert X_missing['R'].isna().all()
+    assert model.predict_proba(X_missing).shape == (3, len(model.classes_))
+
+
+def test_dedupe_race_urls_keeps_first_url_per_race():
+    urls = [
+        'https://race.netkeiba.com/race/shutuba.html?race_id=202505021211',
+        'https://race.netkeiba.com/race/shutuba.html?race_id=202505021210',
+        'https://race.netkeiba.com/race/shutuba.html?race_id=202505021211&rf=race_list',
+        'https://race.netkeiba.com/race/shutuba.html?race_id=202505021210',
+    ]
+    assert dedupe_race_urls(urls) == urls[:2]
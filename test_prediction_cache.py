@@ -0,0 +1,58 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from prediction_cache import PredictionCache
+
+
+def make_data(n_rows=40, random_state=0):
+    rng = np.random.RandomState(random_state)
+    X = pd.DataFrame({'オッズ': rng.gamma(1.5, 10.0, n_rows), '馬番': rng.randint(1, 19, n_rows)})
+    y = rng.randint(1, 4, n_rows)
+    return X, y
+
+
+def save_model(model_path, random_state):
+    X, y = make_data()
+    model = RandomForestClassifier(n_estimators=3, random_state=random_state).fit(X, y)
+    joblib.dump(model, model_path)
+    return model
+
+
+def test_stale_versions_are_removed_in_a_new_process(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    disk_dir = tmp_path / 'prediction_cache'
+    X, _ = make_data()
+
+    # 再学習のたびに新しいプロセス（新しいインスタンス）で予測する
+    for random_state in range(3):
+        model = save_model(model_path, random_state)
+        cache = PredictionCache(model_path=model_path, disk_dir=disk_dir)
+        cache.predict_proba(model, X)
+
+    assert os.listdir(disk_dir) == [cache.model_version]
+
+
+def test_disk_entries_are_capped(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    disk_dir = tmp_path / 'prediction_cache'
+    model = save_model(model_path, 0)
+    X, _ = make_data(n_rows=12)
+
+    cache = PredictionCache(model_path=model_path, max_entries=5, disk_dir=disk_dir)
+    for i in range(len(X)):
+        cache.predict_proba(model, X.iloc[[i]])
+    version_dir = disk_dir / cache.model_version
+    assert len(os.listdir(version_dir)) == 5
+    assert cache.stats()['disk_entries'] == 5
+
+    # 次のプロセスでは、最後に使った5行だけがディスクから返り、結果は predict_proba と一致する
+    cache = PredictionCache(model_path=model_path, max_entries=5, disk_dir=disk_dir)
+    proba = cache.predict_proba(model, X)
+    assert cache.stats()['disk_hits'] == 5
+    assert cache.stats()['misses'] == len(X) - 5
+    assert len(os.listdir(version_dir)) == 5
+    np.testing.assert_allclose(proba, model.predict_proba(X))
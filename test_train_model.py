@@ -0,0 +1,63 @@
+import os
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from train_model import _wait_for_result, derive_race_keys, load_training_data
+
+
+def _put_result(result_queue):
+    result_queue.put({'モデル': 'random_forest'})
+
+
+def _exit_without_result(result_queue):
+    # メモリ不足で強制終了された子プロセスと同じく、結果を入れずに終了する
+    os._exit(9)
+
+
+def test_wait_for_result_returns_none_when_child_dies():
+    context = get_context('fork')
+    for target, expected, exitcode in [(_put_result, {'モデル': 'random_forest'}, 0), (_exit_without_result, None, 9)]:
+        result_queue = context.Queue()
+        process = context.Process(target=target, args=(result_queue,))
+        process.start()
+        assert _wait_for_result(process, result_queue, poll_seconds=0.2) == expected
+        process.join()
+        assert process.exitcode == exitcode
+
+
+def make_career_rows():
+    """馬ごとの戦績の順に並んだ、2年分の同名レース（race_id が異なる）の出走データを作る"""
+    rows = []
+    for horse in range(4):
+        for year, race_id in [(2024, '202405021211'), (2025, '202505021211')]:
+            rows.append({
+                'レース名': '日本ダービー(G1)', '天気': '晴', 'R': 11.0, '頭数': 4.0, '枠番': horse + 1.0,
+                '馬番': horse + 1.0, 'オッズ': 2.0 + horse, '人気': horse + 1.0, '着順': (horse + year) % 4 + 1.0,
+                '騎手': f'騎手{horse}', '斤量': 57.0, '馬場': '良', '馬体重': 480.0, '馬体重の増減': 0.0,
+                '着順区分': 0, 'オッズ欠損': 0, '馬体重欠損': 0, 'race_id': race_id,
+            })
+    return pd.DataFrame(rows)
+
+
+def test_race_keys_follow_race_id(tmp_path):
+    make_career_rows().to_csv(tmp_path / 'cleaned.csv', index=False)
+    X, y, _, race_ids = load_training_data(tmp_path / 'cleaned.csv', drop_rare_classes=False, with_race_ids=True)
+
+    # race_id は特徴量に含めず、同じ race_id の行だけが同じレースになる
+    assert 'race_id' not in X.columns
+    race_keys = derive_race_keys(X, race_ids)
+    np.testing.assert_array_equal(race_keys, [0, 1] * 4)
+
+
+def test_race_keys_without_race_id_split_repeated_horse_numbers(tmp_path):
+    make_career_rows().drop(columns='race_id').to_csv(tmp_path / 'cleaned.csv', index=False)
+    X, y, _, race_ids = load_training_data(tmp_path / 'cleaned.csv', drop_rare_classes=False, with_race_ids=True)
+
+    # race_id が無い場合も、同じ馬番が2回目に現れた行は別のレースになる（1レースに同じ馬番が2頭入らない）
+    assert race_ids is None
+    race_keys = derive_race_keys(X)
+    assert len(np.unique(race_keys)) == 2
+    for key in np.unique(race_keys):
+        assert not X.loc[race_keys == key, '馬番'].duplicated().any()
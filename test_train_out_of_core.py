@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from predict_race import preprocess_predict_data
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# ライブラリの読み込みだけで約160MBを使うため、学習に使えるメモリは約100MBになる
+MEMORY_LIMIT_MB = 256
+# データセットのCSVはメモリ上限の何倍の大きさにするか
+SIZE_FACTOR = 3
+CHUNK_ROWS = 200_000
+
+
+def make_chunk(n_rows, rng):
+    """clean_csv.py が出力するデータと同じ列のチャンクを作る（一部の行は欠損値・競走中止）"""
+    finish = rng.randint(1, 19, n_rows).astype(np.float32)
+    status = np.zeros(n_rows, dtype=np.int8)
+    non_finish = rng.rand(n_rows) < 0.02
+    finish[non_finish] = np.nan
+    status[non_finish] = 1
+    odds = (rng.gamma(1.5, 10.0, n_rows) + 1.0).round(1)
+    odds_missing = rng.rand(n_rows) < 0.01
+    odds[odds_missing] = np.nan
+    weight = rng.randint(400, 560, n_rows).astype(np.float32)
+    weight_missing = rng.rand(n_rows) < 0.01
+    weight[weight_missing] = np.nan
+    return pd.DataFrame({
+        'レース名': np.char.add('レース', rng.randint(0, 2000, n_rows).astype(str)),
+        '天気': rng.choice(['晴', '曇', '雨'], n_rows),
+        'R': rng.randint(1, 13, n_rows),
+        '頭数': rng.randint(8, 19, n_rows),
+        '枠番': rng.randint(1, 9, n_rows),
+        '馬番': rng.randint(1, 19, n_rows),
+        'オッズ': odds,
+        '人気': rng.randint(1, 19, n_rows),
+        '着順': finish,
+        '騎手': np.char.add('騎手', rng.randint(0, 300, n_rows).astype(str)),
+        '斤量': rng.choice([54, 55, 56, 57, 58], n_rows),
+        '馬場': rng.choice(['良', '稍', '重', '不'], n_rows),
+        '馬体重': weight,
+        '馬体重の増減': rng.randint(-12, 13, n_rows),
+        '着順区分': status,
+        'オッズ欠損': odds_missing.astype(np.int8),
+        '馬体重欠損': weight_missing.astype(np.int8),
+    })
+
+
+def write_dataset(path, min_bytes):
+    """CSVの大きさが min_bytes を超えるまでチャンクを追記する"""
+    rng = np.random.RandomState(0)
+    make_chunk(CHUNK_ROWS, rng).to_csv(path, index=False)
+    while os.path.getsize(path) < min_bytes:
+        make_chunk(CHUNK_ROWS, rng).to_csv(path, mode='a', header=False, index=False)
+
+
+def run_python(code, cwd):
+    """新しいPythonのプロセスで code を実行し、標準出力を返す"""
+    script = f"import sys; sys.path.insert(0, {REPO_DIR!r})\n" + code
+    completed = subprocess.run([sys.executable, '-c', script], cwd=cwd, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stdout[-2000:] + completed.stderr[-2000:]
+    return completed.stdout
+
+
+def test_trains_under_memory_limit_on_dataset_larger_than_memory(tmp_path):
+    csv_path = tmp_path / 'cleaned_race_data.csv'
+    min_bytes = SIZE_FACTOR * MEMORY_LIMIT_MB * 1024 * 1024
+    # ピークメモリ（ru_maxrss）は親プロセスから引き継がれることがあるため、データの作成と学習はどちらも別のプロセスで行い、
+    # このプロセスではデータセットをメモリに載せない
+    run_python(f"from test_train_out_of_core import write_dataset\nwrite_dataset({str(csv_path)!r}, {min_bytes})\n", tmp_path)
+    assert os.path.getsize(csv_path) > min_bytes
+
+    stdout = run_python(
+        "from train_out_of_core import train_out_of_core, peak_rss_mb\n"
+        f"train_out_of_core({str(csv_path)!r}, memory_limit_mb={MEMORY_LIMIT_MB}, trees_per_chunk=2)\n"
+        "print(f'PEAK_RSS_MB={peak_rss_mb()}')\n",
+        tmp_path,
+    )
+    peak_line = [line for line in stdout.splitlines() if line.startswith('PEAK_RSS_MB=')]
+    assert peak_line, stdout[-2000:]
+    assert '学習済みモデルとエンコーダーの保存' in stdout, stdout[-2000:]
+    assert float(peak_line[0].split('=')[1]) < MEMORY_LIMIT_MB, stdout[-2000:]
+
+    # 保存したフォレストを読み込み、出馬表を予測スクリプトと同じ前処理で予測できる
+    model = joblib.load(tmp_path / 'random_forest_model.joblib')
+    encoders = joblib.load(tmp_path / 'label_encoders.joblib')
+    card = make_chunk(16, np.random.RandomState(1)).drop(columns=['着順', '着順区分', 'オッズ欠損', '馬体重欠損'])
+    card = card.astype(str).replace('nan', '')
+    card.insert(5, '馬名', [f'馬{i}' for i in range(len(card))])
+    card.loc[card.index[0], 'オッズ'] = '---'
+    X_card = preprocess_predict_data(card, model, encoders)
+    assert X_card is not None
+    proba = model.predict_proba(X_card)
+    assert proba.shape == (len(card), len(model.classes_))
+    np.testing.assert_allclose(proba.sum(axis=1), 1.0)
@@ -1,110 +1,617 @@
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+import numpy as np
+from sklearn.model_selection import train_test_split, GroupShuffleSplit
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
 from sklearn.preprocessing import LabelEncoder
+from pandas.api.types import union_categoricals
 from sklearn.metrics import accuracy_score, classification_report
+from multiprocessing import get_context
+import argparse
+import queue
+import resource
+import tempfile
+import time
 import joblib
+import json
+import os
 
-def train_horse_racing_model(file_path):
+from race_ranker import RaceRanker, ndcg_by_race, pad_groups
+from normalize_race_data import FLAG_COLS, FINISH_STATUS_CODES, RACE_ID_COL
+
+# 学習済みモデルとエンコーダーの保存先（予測スクリプトはこのファイルを読み込む）
+MODEL_PATH = 'random_forest_model.joblib'
+ENCODERS_PATH = 'label_encoders.joblib'
+# tune_model.py が見つけた最良のハイパーパラメータ（モデル名ごと）。存在すれば学習時の既定値になる
+TUNED_PARAMS_PATH = 'tuned_params.json'
+
+CATEGORICAL_COLS = ['レース名', '天気', '騎手', '馬場']
+
+NUMERIC_COLS = ['R', '頭数', '枠番', '馬番', 'オッズ', '人気', '着順', '斤量', '馬体重', '馬体重の増減']
+
+# CSVを一度に読み込む行数（read_csv_lean で使う）
+READ_CHUNK_ROWS = 500_000
+
+# race_id の列が無いデータセットで、同じレースに出走した馬を見分けるための列
+RACE_KEY_COLS = ['レース名', 'R', '頭数', '天気', '馬場']
+
+# ヒストグラム型勾配ブースティングが1つのカテゴリ列で扱えるカテゴリ数の上限
+# （max_bins=255 から、上限を超えた少数カテゴリをまとめる「その他(-1)」の分を引いた数）
+MAX_NATIVE_CATEGORIES = 254
+
+
+def load_tuned_params(backend, params_path=TUNED_PARAMS_PATH):
     """
-    競馬の着順予測モデルを学習し、保存する関数
-    
+    tune_model.py が保存したハイパーパラメータを読み込む関数
+
+    Args:
+        backend (str): モデル名（ESTIMATOR_BACKENDS のキー）
+        params_path (str): ハイパーパラメータのJSONファイルへのパス
+
+    Returns:
+        dict: そのモデルのハイパーパラメータ。ファイルが無い場合や未調整のモデルの場合は空の辞書
+    """
+    try:
+        with open(params_path, encoding='utf-8') as f:
+            return json.load(f).get(backend, {})
+    except FileNotFoundError:
+        return {}
+
+
+def build_random_forest(categorical_cols):
+    """
+    ランダムフォレスト（従来のモデル）を作る関数
+    カテゴリ列はLabelEncoderの整数コードをそのまま数値として扱う
+    """
+    params = {'n_estimators': 100, 'random_state': 42, 'n_jobs': -1}
+    params.update(load_tuned_params('random_forest'))
+    return RandomForestClassifier(**params)
+
+
+def build_hist_gradient_boosting(categorical_cols):
+    """
+    ヒストグラム型の勾配ブースティングを作る関数
+    カテゴリ列は大小関係のないカテゴリとして扱い、検証データの損失が改善しなくなった時点で学習を打ち切る
+    """
+    params = {
+        'max_iter': 300,
+        'categorical_features': categorical_cols,
+        'early_stopping': True,
+        'validation_fraction': 0.1,
+        'n_iter_no_change': 10,
+        'random_state': 42,
+    }
+    params.update(load_tuned_params('hist_gradient_boosting'))
+    return HistGradientBoostingClassifier(**params)
+
+
+# 利用できるモデルの一覧
+# native_categorical が True のモデルは、カテゴリ列を順序のないカテゴリとして直接扱える
+ESTIMATOR_BACKENDS = {
+    'random_forest': {'build': build_random_forest, 'native_categorical': False},
+    'hist_gradient_boosting': {'build': build_hist_gradient_boosting, 'native_categorical': True},
+}
+# --compare で着順分類モデルと並べて計測する、レース単位の順位付けモデルの名前
+RANKER_BACKEND = 'race_ranker'
+# --compare で子プロセスが終了していないかを確かめる間隔（秒）
+RESULT_POLL_SECONDS = 5
+
+
+def encode_categorical_columns(df, categorical_cols, max_categories=None):
+    """
+    カテゴリ列（category型）をLabelEncoderと同じ整数コードに変換する関数
+    category型の内部コードを並べ替えるだけなので、文字列を1件ずつ比較することはない
+
+    Args:
+        df (pd.DataFrame): 変換するデータ（列を上書きする）
+        categorical_cols (list): カテゴリ列の列名
+        max_categories (int): 1列あたりのカテゴリ数の上限。上限を超えた少数のカテゴリは
+                              予測時の未知のカテゴリと同じ -1 にまとめる。Noneの場合は上限なし
+
+    Returns:
+        dict: 列名をキーとするLabelEncoderの辞書
+    """
+    encoders = {}
+    for col in categorical_cols:
+        if col in df.columns:
+            series = df[col].astype('category').cat.remove_unused_categories()
+            categories = np.asarray(series.cat.categories, dtype=object)
+            raw_codes = series.cat.codes.to_numpy()
+            if max_categories is None:
+                kept = categories
+            else:
+                counts = np.bincount(raw_codes[raw_codes >= 0], minlength=len(categories))
+                kept = categories[np.argsort(-counts, kind='stable')[:max_categories]]
+
+            # LabelEncoderはクラスを昇順に並べて0から番号を付けるため、それに合わせる
+            le = LabelEncoder()
+            le.classes_ = np.sort(kept)
+            category_to_code = np.full(len(categories), -1, dtype=np.int32)
+            is_kept = np.isin(categories, le.classes_)
+            category_to_code[is_kept] = np.searchsorted(le.classes_, categories[is_kept])
+            # 欠損値（category型のコード -1）も未知のカテゴリと同じ -1 にする
+            codes = np.where(raw_codes >= 0, category_to_code[raw_codes], -1)
+            df[col] = pd.to_numeric(pd.Series(codes, index=df.index), downcast='integer')
+            encoders[col] = le
+            print(f"'{col}'列を数値に変換しました。")
+    return encoders
+
+
+def iter_csv_chunks_lean(file_path, chunksize=READ_CHUNK_ROWS):
+    """
+    CSVを chunksize 行ずつ読み込み、数値列を float32（変換できない値はNaN）、文字列の列を category 型にして返すジェネレーター
+
+    Args:
+        file_path (str): CSVファイルへのパス
+        chunksize (int): 一度に読み込む行数
+
+    Yields:
+        pd.DataFrame: 省メモリの型に変換したチャンク
+    """
+    dtypes = {col: 'category' for col in CATEGORICAL_COLS}
+    dtypes.update({col: np.int8 for col in FLAG_COLS})
+    dtypes[RACE_ID_COL] = str
+    for chunk in pd.read_csv(file_path, chunksize=chunksize, dtype=dtypes):
+        for col in NUMERIC_COLS:
+            if col in chunk.columns:
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce', downcast='float').astype(np.float32)
+        if RACE_ID_COL in chunk.columns:
+            # race_id（12桁）は int64 に収まる。取得できなかった行は -1 にする
+            chunk[RACE_ID_COL] = pd.to_numeric(chunk[RACE_ID_COL], errors='coerce').fillna(-1).astype(np.int64)
+        yield chunk
+
+
+def read_csv_lean(file_path, chunksize=READ_CHUNK_ROWS):
+    """
+    CSVを少しずつ読み込み、読み込んだ分から省メモリの型に変換して1つのデータフレームにまとめる関数
+    一度に全体を読み込むと、変換前の float64/int64 や文字列の列が全行分メモリに載るため、
+    iter_csv_chunks_lean でチャンクごとに変換してから結合する
+
+    Args:
+        file_path (str): CSVファイルへのパス
+        chunksize (int): 一度に読み込む行数
+
+    Returns:
+        pd.DataFrame: 省メモリの型に変換したデータ
+    """
+    chunks = list(iter_csv_chunks_lean(file_path, chunksize=chunksize))
+
+    # チャンクごとにカテゴリの種類が異なるため、カテゴリを統合してから結合する
+    columns = {}
+    for col in chunks[0].columns:
+        if col in CATEGORICAL_COLS:
+            columns[col] = union_categoricals([chunk[col] for chunk in chunks])
+        else:
+            columns[col] = np.concatenate([chunk[col].to_numpy() for chunk in chunks])
+        for chunk in chunks:
+            del chunk[col]
+    return pd.DataFrame(columns)
+
+
+def training_row_mask(df):
+    """
+    学習に使える行（着順がある行）のマスクを返す関数
+    clean_csv.py は競走中止・取消などの行も着順を欠損値にして残すため、着順区分がある場合は完走した行だけを選ぶ
+    オッズや馬体重の欠損値は、決定木が欠損値のまま扱えるため行を除かない
+    """
+    keep = df['着順'].notna().to_numpy()
+    if '着順区分' in df.columns:
+        keep = keep & (df['着順区分'].to_numpy() == FINISH_STATUS_CODES['完走'])
+    return keep
+
+
+def load_training_data(file_path, native_categorical=False, drop_rare_classes=True, with_race_ids=False):
+    """
+    データセットを読み込み、学習用の特徴量(X)と目的変数(y)に整形する関数
+    各列は値の範囲に収まる最小の型（int8/int16、float32、category）で保持する
+
     Args:
         file_path (str): データセットのCSVファイルへのパス
+        native_categorical (bool): Trueの場合、カテゴリ数を MAX_NATIVE_CATEGORIES 以下に抑えて変換する
+        drop_rare_classes (bool): Trueの場合、層化分割のためにサンプル数が1つしかない着順の行を削除する
+        with_race_ids (bool): Trueの場合、各行の race_id も返す
+
+    Returns:
+        tuple: (X, y, encoders)。with_race_ids が True の場合は (X, y, encoders, race_ids)
+               （race_ids は int64 の配列で、取得できなかった行は -1。列が無いデータセットでは None）。
+               ファイルが見つからない場合は None
     """
     # 1. データの読み込み
     print("--- 1. データの読み込み ---")
     try:
-        # DtypeWarningを避けるため、low_memory=Falseを指定
-        df = pd.read_csv(file_path, low_memory=False)
+        df = read_csv_lean(file_path)
         print(f"読み込み完了: {len(df)}件のレースデータ")
     except FileNotFoundError:
         print(f"エラー: ファイル '{file_path}' が見つかりません。")
-        return
+        return None
 
     # 2. 前処理
     print("\n--- 2. データの前処理 ---")
 
-    # --- ★★★ 修正点1: データ型を強制し、追加で欠損値を削除 ★★★ ---
-    print("数値列を強制的に数値型に変換し、変換不能な行を削除します...")
-    numeric_cols = ['R', '頭数', '枠番', '馬番', 'オッズ', '人気', '着順', '斤量', '馬体重', '馬体重の増減']
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # 型変換によってNaNになった行を削除
-    rows_before_dropna = len(df)
-    df.dropna(inplace=True)
-    rows_after_dropna = len(df)
-    print(f"追加の欠損値処理完了。{rows_before_dropna - rows_after_dropna}件の行を削除しました。")
+    # --- ★★★ 修正点1: 着順がない行だけを除き、特徴量の欠損値は残す ★★★ ---
+    # 数値列は read_csv_lean で float32 に変換済み（変換できない値はNaN）
+    print("着順がない行（競走中止・取消など）を目的変数から除きます...")
 
-    # 着順を整数型に変換
-    df['着順'] = df['着順'].astype(int)
+    # 着順がない行と少数クラスの行を1つのマスクにまとめ、行の削除によるコピーを1回にする
+    keep = training_row_mask(df)
+    rows_without_finish = len(df) - keep.sum()
+    rows_with_missing = (keep & df.isna().any(axis=1).to_numpy()).sum()
+    print(f"着順がない{rows_without_finish}件の行を除きました。"
+          f"特徴量に欠損値を含む{rows_with_missing}件の行は欠損値のまま学習に使います。")
     # --- ★★★ 修正ここまで ★★★ ---
 
 
     # --- ★★★ 修正点2: サンプル数が1つのクラスをデータセットから削除 ★★★ ---
-    print("サンプル数が1つしかない着順データを削除します...")
-    value_counts = df['着順'].value_counts()
-    to_remove = value_counts[value_counts < 2].index
-    
-    rows_before_filter = len(df)
-    df = df[~df['着順'].isin(to_remove)]
-    rows_after_filter = len(df)
-    print(f"少数クラスのフィルタリング完了。{rows_before_filter - rows_after_filter}件の行を削除しました。")
+    if drop_rare_classes:
+        print("サンプル数が1つしかない着順データを削除します...")
+        value_counts = df.loc[keep, '着順'].value_counts()
+        to_remove = value_counts[value_counts < 2].index
+        rare = keep & df['着順'].isin(to_remove).to_numpy()
+        keep = keep & ~rare
+        print(f"少数クラスのフィルタリング完了。{rare.sum()}件の行を削除しました。")
     # --- ★★★ 修正ここまで ★★★ ---
 
+    if not keep.all():
+        df = df[keep]
+    # フラグの列は行の選別にだけ使い、特徴量には含めない（予測時の出馬表には無いため）
+    for col in FLAG_COLS:
+        if col in df.columns:
+            del df[col]
+    # race_id はレースのまとまりを見分けるためだけに使う
+    race_ids = df.pop(RACE_ID_COL).to_numpy() if RACE_ID_COL in df.columns else None
+
+    # 整数しか入っていない列（着順・頭数・馬体重など）は int8/int16 に縮める
+    for col in NUMERIC_COLS:
+        if col in df.columns and (df[col] % 1 == 0).all():
+            df[col] = pd.to_numeric(df[col], downcast='integer')
 
     # カテゴリ変数を数値に変換
-    encoders = {}
-    categorical_cols = ['レース名', '天気', '騎手', '馬場']
-    for col in categorical_cols:
-        if col in df.columns:
-            le = LabelEncoder()
-            df[col] = le.fit_transform(df[col])
-            encoders[col] = le
-            print(f"'{col}'列を数値に変換しました。")
+    encoders = encode_categorical_columns(
+        df, CATEGORICAL_COLS, max_categories=MAX_NATIVE_CATEGORIES if native_categorical else None
+    )
 
     # 3. 特徴量(X)と目的変数(y)の定義
     print("\n--- 3. 特徴量と目的変数の設定 ---")
-    X = df.drop('着順', axis=1)
-    y = df['着順']
+    # drop は残りの列を全てコピーするため、目的変数の列だけを取り出す
+    y = df.pop('着順')
+    X = df
     print("特徴量(X)と目的変数(y)を設定しました。")
-    print(f"最終的な学習データ数: {len(df)}件")
+    print(f"最終的な学習データ数: {len(X)}件")
+
+    if with_race_ids:
+        return X, y, encoders, race_ids
+    return X, y, encoders
+
+
+def build_feature_matrix(X, row_order, out=None):
+    """
+    特徴量を row_order の行順で、1つの連続したfloat32の配列に詰める関数
+    列ごとに書き込むため、途中でデータ全体のコピーを作らない
+
+    Args:
+        X (pd.DataFrame): load_training_data が返した特徴量
+        row_order (np.ndarray): 配列に並べる行の位置
+        out (np.ndarray): 書き込み先の (len(row_order), 列数) のfloat32配列（共有メモリ上の配列など）。
+                          Noneの場合は新しく確保する
+
+    Returns:
+        pd.DataFrame: float32の配列をコピーせずに包んだデータフレーム（列名は X と同じ）
+    """
+    matrix = np.empty((len(row_order), X.shape[1]), dtype=np.float32) if out is None else out
+    for j, col in enumerate(X.columns):
+        matrix[:, j] = X[col].to_numpy()[row_order]
+    return pd.DataFrame(matrix, columns=X.columns, copy=False)
+
+
+def split_feature_matrix(X, y, groups=None, test_size=0.2, out=None):
+    """
+    訓練データとテストデータに分割する関数
+    先に分割後の行順を決めてから1つの配列に詰め、訓練データとテストデータはその配列の前半・後半を
+    そのまま参照する（train_test_split のように分割のたびにデータをコピーしない）
+
+    Args:
+        X (pd.DataFrame): load_training_data が返した特徴量
+        y (pd.Series): 着順
+        groups (np.ndarray): 各行のレース番号。指定した場合はレース単位で分割し、指定しない場合は着順で層化分割する
+        test_size (float): テストデータの割合
+        out (np.ndarray): 特徴量の書き込み先（build_feature_matrix を参照）
+
+    Returns:
+        tuple: (X_train, X_test, y_train, y_test, row_order)。row_order は配列の各行が X の何行目かを表す
+    """
+    positions = np.arange(len(X))
+    if groups is None:
+        train_idx, test_idx = train_test_split(positions, test_size=test_size, random_state=42, stratify=y)
+    else:
+        splitter = GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=42)
+        train_idx, test_idx = next(splitter.split(positions, groups=groups))
+
+    row_order = np.concatenate([train_idx, test_idx])
+    matrix = build_feature_matrix(X, row_order, out=out)
+    y_ordered = y.to_numpy()[row_order]
+    n_train = len(train_idx)
+    return matrix.iloc[:n_train], matrix.iloc[n_train:], y_ordered[:n_train], y_ordered[n_train:], row_order
+
+
+def train_horse_racing_model(file_path, backend='random_forest'):
+    """
+    競馬の着順予測モデルを学習し、保存する関数
+
+    Args:
+        file_path (str): データセットのCSVファイルへのパス
+        backend (str): 使用するモデル（ESTIMATOR_BACKENDS のキー）
+    """
+    estimator_backend = ESTIMATOR_BACKENDS[backend]
+    training_data = load_training_data(file_path, native_categorical=estimator_backend['native_categorical'])
+    if training_data is None:
+        return
+    X, y, encoders = training_data
 
     # 4. 訓練データとテストデータに分割
     print("\n--- 4. データの分割 ---")
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
-    )
+    X_train, X_test, y_train, y_test, _ = split_feature_matrix(X, y)
+    feature_names = X.columns
+    # 以降は float32 の配列だけを使うため、列ごとのデータは解放する
+    del X, y
     print(f"訓練データ: {len(X_train)}件, テストデータ: {len(X_test)}件")
 
-    # 5. ランダムフォレストモデルの学習
-    print("\n--- 5. モデルの学習開始 ---")
-    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+    # 5. モデルの学習
+    print(f"\n--- 5. モデルの学習開始 ({backend}) ---")
+    model = estimator_backend['build']([col for col in CATEGORICAL_COLS if col in feature_names])
     model.fit(X_train, y_train)
     print("モデルの学習が完了しました。")
+    if hasattr(model, 'n_iter_'):
+        print(f"ブースティング回数: {model.n_iter_} 回 (上限 {model.max_iter} 回、早期終了あり)")
 
     # 6. モデルの評価
     print("\n--- 6. モデルの性能評価 ---")
     y_pred = model.predict(X_test)
     accuracy = accuracy_score(y_test, y_pred)
     print(f"テストデータに対する正解率 (Accuracy): {accuracy:.4f}")
-    
+
     print("\n詳細レポート (Classification Report):")
     print(classification_report(y_test, y_pred, zero_division=0))
 
-    print("\n--- 特徴量の重要度 ---")
-    feature_importances = pd.Series(model.feature_importances_, index=X.columns)
-    print(feature_importances.sort_values(ascending=False))
+    # 特徴量の重要度はランダムフォレストなど feature_importances_ を持つモデルのみ表示する
+    if hasattr(model, 'feature_importances_'):
+        print("\n--- 特徴量の重要度 ---")
+        feature_importances = pd.Series(model.feature_importances_, index=feature_names)
+        print(feature_importances.sort_values(ascending=False))
+
+    # 7. モデルとエンコーダーの保存
+    print("\n--- 7. 学習済みモデルとエンコーダーの保存 ---")
+    joblib.dump(model, MODEL_PATH)
+    joblib.dump(encoders, ENCODERS_PATH)
+    print(f"'{MODEL_PATH}' と '{ENCODERS_PATH}' を保存しました。")
+
+
+def derive_race_keys(X, race_ids=None):
+    """
+    各行が属するレースの番号を求める関数
+    race_id がある行は race_id でまとめる。race_id が無い行は RACE_KEY_COLS の値の組み合わせでまとめ、
+    同じ組み合わせの中で同じ馬番が再び現れたら別のレースとみなす
+    （データセットは馬ごとの戦績の順に並んでいるため、別の年の同名レースも同じ組み合わせになる）
+
+    Args:
+        X (pd.DataFrame): 特徴量
+        race_ids (np.ndarray): 各行の race_id（取得できなかった行は -1）。None の場合は全ての行を組み合わせでまとめる
+
+    Returns:
+        np.ndarray: 各行のレース番号（0始まりの整数）
+    """
+    key_cols = [col for col in RACE_KEY_COLS if col in X.columns]
+    # キーの列に欠損値がある行も1つのレースとしてまとめる
+    grouped = X.groupby(key_cols, sort=False, dropna=False)
+    # 同じ組み合わせの中で、その馬番が何回目に現れたか（1回目の馬番は1つ目のレース、2回目は2つ目のレース、...）
+    occurrence = X.groupby(key_cols + ['馬番'], sort=False, dropna=False).cumcount().to_numpy()
+    fallback_keys = grouped.ngroup().to_numpy().astype(np.int64) * (occurrence.max() + 1) + occurrence
+
+    if race_ids is None:
+        return np.unique(fallback_keys, return_inverse=True)[1]
+    # race_id は0以上、組み合わせによるキーは負の数にして、両者が同じ番号にならないようにする
+    race_keys = np.where(race_ids >= 0, race_ids, -1 - fallback_keys)
+    return np.unique(race_keys, return_inverse=True)[1]
+
+
+def train_race_ranking_model(file_path):
+    """
+    レースごとに出走馬をまとめて順位付けするモデル（RaceRanker）を学習し、保存する関数
+    1頭ずつ着順のクラスを当てるのではなく、同じレースの馬同士の着順の上下関係を学習する
+
+    Args:
+        file_path (str): データセットのCSVファイルへのパス
+    """
+    # ペアで学習するため、少数の着順クラスを削除する必要はない
+    training_data = load_training_data(file_path, drop_rare_classes=False, with_race_ids=True)
+    if training_data is None:
+        return
+    X, y, encoders, race_ids = training_data
+
+    # 4. レース単位で訓練データとテストデータに分割（同じレースの馬が両方に分かれないようにする）
+    print("\n--- 4. レース単位でのデータの分割 ---")
+    if race_ids is None or (race_ids < 0).any():
+        n_without_id = len(X) if race_ids is None else (race_ids < 0).sum()
+        print(f"race_id が無い{n_without_id}件の行は、レース名・R・頭数・天気・馬場と馬番の重複からレースを推定します。")
+    race_keys = derive_race_keys(X, race_ids)
+    X_train, X_test, y_train, y_test, row_order = split_feature_matrix(X, y, groups=race_keys)
+    race_keys = race_keys[row_order]
+    groups_train, groups_test = race_keys[:len(X_train)], race_keys[len(X_train):]
+    del X, y
+    print(f"訓練データ: {len(np.unique(groups_train))}レース {len(X_train)}件, "
+          f"テストデータ: {len(np.unique(groups_test))}レース {len(X_test)}件")
+
+    # 5. ランキングモデルの学習
+    print("\n--- 5. ランキングモデルの学習開始 ---")
+    model = RaceRanker()
+    fit_started_at = time.perf_counter()
+    model.fit(X_train, y_train, groups_train, eval_set=(X_test, y_test, groups_test))
+    fit_seconds = time.perf_counter() - fit_started_at
+    print(f"モデルの学習が完了しました。学習時間: {fit_seconds:.1f}秒 ({len(X_train) / fit_seconds:,.0f}行/秒)")
+
+    # 6. モデルの評価（レース単位）
+    print("\n--- 6. モデルの性能評価 ---")
+    scores = model.predict_score(X_test)
+    index, mask = pad_groups(groups_test)
+    ndcg = ndcg_by_race(scores, y_test, index, mask)
+    padded_scores = np.where(mask, scores[index], -np.inf)
+    predicted_winner = index[np.arange(len(index)), padded_scores.argmax(axis=1)]
+    top1_hit_rate = (y_test[predicted_winner] == 1).mean()
+    print(f"テストデータのNDCG (レース平均): {ndcg.mean():.4f}")
+    print(f"スコア1位の馬が1着だった割合: {top1_hit_rate:.4f}")
 
     # 7. モデルとエンコーダーの保存
     print("\n--- 7. 学習済みモデルとエンコーダーの保存 ---")
-    joblib.dump(model, 'random_forest_model.joblib')
-    joblib.dump(encoders, 'label_encoders.joblib')
-    print("'random_forest_model.joblib' と 'label_encoders.joblib' を保存しました。")
+    joblib.dump(model, MODEL_PATH)
+    joblib.dump(encoders, ENCODERS_PATH)
+    print(f"'{MODEL_PATH}' と '{ENCODERS_PATH}' を保存しました。")
+
+
+def _measure_backend(backend, X_train, y_train, X_test, y_test, card_size, result_queue, groups_train=None):
+    """
+    子プロセスの中で1つのモデルを学習し、計測結果をキューに入れる関数
+    ピークメモリ（ru_maxrss）はプロセス単位でしか取れないため、モデルごとにプロセスを分ける
+    backend が RANKER_BACKEND の場合は RaceRanker を groups_train のレース単位で学習し、predict_score の時間を計測する
+    """
+    baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if backend == RANKER_BACKEND:
+        model = RaceRanker()
+        fit_args = (X_train, y_train, groups_train)
+        predict = model.predict_score
+    else:
+        model = ESTIMATOR_BACKENDS[backend]['build']([col for col in CATEGORICAL_COLS if col in X_train.columns])
+        fit_args = (X_train, y_train)
+        predict = model.predict_proba
+
+    fit_started_at = time.perf_counter()
+    model.fit(*fit_args)
+    fit_seconds = time.perf_counter() - fit_started_at
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_file = os.path.join(tmp_dir, 'model.joblib')
+        joblib.dump(model, model_file)
+        model_size = os.path.getsize(model_file)
+
+    # 出馬表1枚分（card_size頭）の予測にかかる時間の中央値
+    card = X_test.iloc[:card_size]
+    predict(card)
+    card_latencies = []
+    for _ in range(20):
+        started_at = time.perf_counter()
+        predict(card)
+        card_latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    predict(X_test)
+    batch_seconds = time.perf_counter() - started_at
+
+    result_queue.put({
+        'モデル': backend,
+        '学習時間(秒)': fit_seconds,
+        '学習速度(行/秒)': len(X_train) / fit_seconds,
+        'ピークメモリ増分(MB)': (peak_rss_kb - baseline_rss_kb) / 1024,
+        'モデルサイズ(MB)': model_size / 1024 / 1024,
+        f'予測時間 {card_size}頭(ミリ秒)': np.median(card_latencies) * 1000,
+        f'予測時間 {len(X_test)}件(秒)': batch_seconds,
+        # 順位付けモデルは着順のクラスを予測しないため、正解率の代わりに空欄にする
+        '正解率': np.nan if backend == RANKER_BACKEND else accuracy_score(y_test, model.predict(X_test)),
+    })
+
+
+def _wait_for_result(process, result_queue, poll_seconds=RESULT_POLL_SECONDS):
+    """
+    子プロセスの計測結果を待つ関数
+    子プロセスが結果を入れる前に終了した場合（学習中の例外、メモリ不足で強制終了された場合など）は待ち続けずに None を返す
+
+    Returns:
+        dict: 計測結果。子プロセスが結果を返さずに終了した場合は None
+    """
+    while True:
+        try:
+            return result_queue.get(timeout=poll_seconds)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # 終了の直前に入れられた結果がまだ届いていない場合に備えて、もう一度だけ待つ
+        try:
+            return result_queue.get(timeout=poll_seconds)
+        except queue.Empty:
+            return None
+
+
+def compare_estimator_backends(file_path, backends=None, card_size=18):
+    """
+    同じデータで複数のモデルを学習し、学習時間・ピークメモリ・モデルサイズ・予測時間を比較する関数
+    レース単位の順位付けモデル（RANKER_BACKEND）も、着順分類モデルと同じ訓練データの行で学習時間を比べる
+
+    Args:
+        file_path (str): データセットのCSVファイルへのパス
+        backends (list): 比較するモデル名のリスト。Noneの場合は ESTIMATOR_BACKENDS の全てと RANKER_BACKEND
+        card_size (int): 予測時間を計測する出馬表1枚分の頭数
+    """
+    backends = backends or list(ESTIMATOR_BACKENDS) + [RANKER_BACKEND]
+    results = []
+    race_keys = None
+    for backend in backends:
+        # カテゴリ列の変換方法がモデルによって異なるため、モデルごとにデータを作る
+        native_categorical = backend != RANKER_BACKEND and ESTIMATOR_BACKENDS[backend]['native_categorical']
+        training_data = load_training_data(file_path, native_categorical=native_categorical, drop_rare_classes=False,
+                                           with_race_ids=True)
+        if training_data is None:
+            return
+        X, y, _, race_ids = training_data
+        # 全てのモデルを同じ行で比べるため、最初に求めたレース番号で全てのモデルをレース単位に分割する
+        # （行の並びはモデルによらず同じだが、カテゴリ列の変換方法でレース番号の振り方が変わるため）
+        if race_keys is None:
+            race_keys = derive_race_keys(X, race_ids)
+        X_train, X_test, y_train, y_test, row_order = split_feature_matrix(X, y, groups=race_keys)
+        groups_train = race_keys[row_order][:len(X_train)]
+        del X, y
+
+        print(f"\n--- {backend} の計測 ---")
+        # fork した子プロセスは親のデータをコピーせずに参照できる
+        context = get_context('fork')
+        result_queue = context.Queue()
+        process = context.Process(
+            target=_measure_backend,
+            args=(backend, X_train, y_train, X_test, y_test, card_size, result_queue, groups_train),
+        )
+        process.start()
+        result = _wait_for_result(process, result_queue)
+        process.join()
+        if result is None:
+            # 1つのモデルが失敗しても比較は止めず、そのモデルを失敗として表に残す
+            print(f"{backend} の計測に失敗しました（子プロセスの終了コード: {process.exitcode}）。")
+            result = {'モデル': backend, '状態': f'失敗 (終了コード {process.exitcode})'}
+        else:
+            result['状態'] = '完了'
+        results.append(result)
+
+    print("\n--- ★★★ モデルの比較結果 ★★★ ---")
+    pd.options.display.float_format = '{:.3f}'.format
+    print(pd.DataFrame(results).to_string(index=False))
 
 
 if __name__ == '__main__':
-    csv_file_path = 'cleaned_race_data.csv'
-    train_horse_racing_model(csv_file_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="競馬の着順予測モデルを学習します。")
+    parser.add_argument('csv_file', nargs='?', default='cleaned_race_data.csv',
+                        help="データセットのCSVファイル（デフォルト: cleaned_race_data.csv）")
+    parser.add_argument('--backend', choices=list(ESTIMATOR_BACKENDS), default='random_forest',
+                        help="使用するモデル（デフォルト: random_forest）")
+    parser.add_argument('--rank', action='store_true',
+                        help="1頭ずつの着順分類ではなく、レース単位で順位付けするモデルを学習する")
+    parser.add_argument('--compare', action='store_true',
+                        help="全てのモデルを同じデータで学習し、学習時間・メモリ・モデルサイズ・予測時間を比較する")
+    parser.add_argument('--tune', action='store_true',
+                        help="--backend のハイパーパラメータを探索し、最良の設定を学習時の既定値にする（詳細な設定は tune_model.py）")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_estimator_backends(args.csv_file)
+    elif args.tune:
+        # tune_model は train_model の関数を使うため、ここで読み込む
+        from tune_model import tune_hyperparameters
+        tune_hyperparameters(args.csv_file, backend=args.backend)
+    elif args.rank:
+        train_race_ranking_model(args.csv_file)
+    else:
+        train_horse_racing_model(args.csv_file, backend=args.backend)
@@ -0,0 +1,225 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder
+from sklearn.metrics import accuracy_score
+import argparse
+import resource
+import math
+import gc
+import joblib
+
+from train_model import MODEL_PATH, ENCODERS_PATH, CATEGORICAL_COLS, iter_csv_chunks_lean, training_row_mask
+from normalize_race_data import FLAG_COLS, RACE_ID_COL
+
+# 1行の学習に必要なメモリの見積もり（CSVの文字列、float32の特徴量、木の構築時の作業領域などの合計）
+TRAINING_BYTES_PER_ROW = 1024
+# 木の1ノードあたりのメモリ（ノード本体。これに着順クラス数 × 8バイトの値が加わる）
+NODE_BYTES = 64
+# メモリ上限のうち、マージ後のフォレストに割り当てる割合
+MODEL_MEMORY_FRACTION = 0.25
+# 各チャンクから評価用に取り分ける行の割合と、評価用に保持する最大行数
+EVAL_FRACTION = 0.1
+EVAL_RESERVOIR_ROWS = 50_000
+
+
+def peak_rss_mb():
+    """このプロセスのピークメモリ使用量(MB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def scan_dataset(file_path, chunksize):
+    """
+    データセットを1回読み流し、全チャンクに共通のエンコーダーと着順のクラスを作る関数
+    チャンクごとに別々に学習したサブフォレストをまとめるには、カテゴリの番号と着順のクラスが揃っている必要がある
+
+    Args:
+        file_path (str): データセットのCSVファイルへのパス
+        chunksize (int): 一度に読み込む行数
+
+    Returns:
+        tuple: (encoders, classes, n_rows, feature_columns)
+    """
+    categories = {col: set() for col in CATEGORICAL_COLS}
+    classes = set()
+    n_rows = 0
+    feature_columns = None
+    for chunk in iter_csv_chunks_lean(file_path, chunksize=chunksize):
+        chunk = chunk[training_row_mask(chunk)]
+        for col in CATEGORICAL_COLS:
+            if col in chunk.columns:
+                categories[col].update(chunk[col].cat.remove_unused_categories().cat.categories)
+        classes.update(np.unique(chunk['着順'].to_numpy()).astype(int))
+        n_rows += len(chunk)
+        feature_columns = [col for col in chunk.columns if col not in ('着順', RACE_ID_COL) and col not in FLAG_COLS]
+
+    encoders = {}
+    for col, values in categories.items():
+        if feature_columns is not None and col in feature_columns:
+            le = LabelEncoder()
+            le.classes_ = np.sort(np.array(list(values), dtype=object))
+            encoders[col] = le
+    return encoders, np.array(sorted(classes)), n_rows, feature_columns
+
+
+def chunk_to_matrix(chunk, encoders, feature_columns, extra_rows=0):
+    """
+    チャンクを float32 の特徴量の配列と着順の配列に変換する関数
+
+    Args:
+        chunk (pd.DataFrame): iter_csv_chunks_lean が返したチャンク
+        encoders (dict): scan_dataset で作ったエンコーダー
+        feature_columns (list): 特徴量の列名（学習時の列順）
+        extra_rows (int): 配列の末尾に確保しておく空き行の数
+
+    Returns:
+        tuple: (matrix, y)。着順がない行は除かれる（特徴量の欠損値はNaNのまま）
+    """
+    chunk = chunk[training_row_mask(chunk)]
+    n_rows = len(chunk)
+    matrix = np.zeros((n_rows + extra_rows, len(feature_columns)), dtype=np.float32)
+    for j, col in enumerate(feature_columns):
+        if col in encoders:
+            # チャンク内のカテゴリを、全体で共通の番号に付け替える
+            chunk_categories = np.asarray(chunk[col].cat.categories, dtype=object)
+            category_to_code = np.searchsorted(encoders[col].classes_, chunk_categories)
+            # 欠損値（コード -1）は予測時の未知のカテゴリと同じ -1 にする
+            codes = chunk[col].cat.codes.to_numpy()
+            matrix[:n_rows, j] = np.where(codes >= 0, category_to_code[codes], -1)
+        else:
+            matrix[:n_rows, j] = chunk[col].to_numpy()
+    return matrix, chunk['着順'].to_numpy().astype(np.int16)
+
+
+def update_reservoir(reservoir, X_new, y_new, rng, max_rows):
+    """
+    評価用の行を、これまでに読んだ全チャンクからの一様な無作為抽出として max_rows 行まで保持する関数
+    各行に乱数のキーを付け、キーの小さい max_rows 行だけを残す（ボトムkサンプリング）
+
+    Returns:
+        tuple: 更新後の (X, y, keys)
+    """
+    keys_new = rng.rand(len(y_new))
+    if reservoir is None:
+        X_all, y_all, keys_all = X_new, y_new, keys_new
+    else:
+        X_all = np.concatenate([reservoir[0], X_new])
+        y_all = np.concatenate([reservoir[1], y_new])
+        keys_all = np.concatenate([reservoir[2], keys_new])
+    if len(keys_all) > max_rows:
+        kept = np.argpartition(keys_all, max_rows)[:max_rows]
+        X_all, y_all, keys_all = X_all[kept], y_all[kept], keys_all[kept]
+    return X_all, y_all, keys_all
+
+
+def train_out_of_core(file_path, memory_limit_mb=1024, trees_per_chunk=10, chunk_rows=None):
+    """
+    メモリに載りきらないデータセットから、チャンクごとにサブフォレストを学習して1つのランダムフォレストにまとめる関数
+    保存するモデルは通常の RandomForestClassifier なので、予測スクリプトはそのまま使える
+
+    Args:
+        file_path (str): データセットのCSVファイルへのパス
+        memory_limit_mb (int): 学習中のメモリ使用量の上限(MB)
+        trees_per_chunk (int): 1チャンクあたりに学習する木の本数
+        chunk_rows (int): 1チャンクの行数。Noneの場合はメモリ上限から決める
+    """
+    memory_limit = memory_limit_mb * 1024 * 1024
+    available = memory_limit - peak_rss_mb() * 1024 * 1024
+    if available <= 0:
+        print(f"エラー: メモリ上限 {memory_limit_mb}MB が、ライブラリの読み込みだけで使うメモリ ({peak_rss_mb():.0f}MB) より小さいです。")
+        return
+    model_budget = available * MODEL_MEMORY_FRACTION
+    if chunk_rows is None:
+        chunk_rows = max(1000, int((available - model_budget) / TRAINING_BYTES_PER_ROW))
+
+    # 1. データの走査
+    print("--- 1. データの走査（カテゴリ・着順のクラス・行数の集計） ---")
+    try:
+        encoders, classes, n_rows, feature_columns = scan_dataset(file_path, chunk_rows)
+    except FileNotFoundError:
+        print(f"エラー: ファイル '{file_path}' が見つかりません。")
+        return
+    if n_rows == 0:
+        print("エラー: 学習に使える行がありません。")
+        return
+    print(f"有効な行数: {n_rows}件, 着順のクラス: {len(classes)}種類")
+
+    # 2. メモリ上限に収まるように、チャンクの行数と木の大きさを決める
+    n_chunks = math.ceil(n_rows / chunk_rows)
+    n_trees = n_chunks * trees_per_chunk
+    node_bytes = NODE_BYTES + 8 * len(classes)
+    max_leaf_nodes = max(2, int(model_budget / (n_trees * 2 * node_bytes)))
+    print("\n--- 2. 学習の計画 ---")
+    print(f"メモリ上限: {memory_limit_mb}MB, 1チャンク: 最大{chunk_rows}行, チャンク数: 約{n_chunks}")
+    print(f"木の本数: {n_trees}本 (1チャンクあたり{trees_per_chunk}本), 1本あたりの最大の葉の数: {max_leaf_nodes}")
+
+    # 3. チャンクごとにサブフォレストを学習
+    print("\n--- 3. チャンクごとのサブフォレストの学習 ---")
+    rng = np.random.RandomState(42)
+    forest = None
+    reservoir = None
+    for i, chunk in enumerate(iter_csv_chunks_lean(file_path, chunksize=chunk_rows)):
+        # 末尾に全クラス1行ずつの空き行を足しておき、重み0で学習に加える
+        # （チャンクに無い着順があっても、全てのサブフォレストの classes_ が同じになる）
+        X_chunk, y_chunk = chunk_to_matrix(chunk, encoders, feature_columns, extra_rows=len(classes))
+        del chunk
+        n_real = len(y_chunk)
+        if n_real == 0:
+            continue
+
+        # 評価用の行は配列から取り除かずに重み0にする（チャンクのコピーを作らないため）
+        is_eval = rng.rand(n_real) < EVAL_FRACTION
+        reservoir = update_reservoir(reservoir, X_chunk[:n_real][is_eval], y_chunk[is_eval], rng, EVAL_RESERVOIR_ROWS)
+        y_fit = np.concatenate([y_chunk, classes.astype(np.int16)])
+        sample_weight = np.concatenate([(~is_eval).astype(np.float64), np.zeros(len(classes))])
+
+        sub_forest = RandomForestClassifier(
+            n_estimators=trees_per_chunk, max_leaf_nodes=max_leaf_nodes, random_state=42 + i, n_jobs=-1
+        )
+        # データフレームで包むと、pandas のバージョンによっては読み取り専用の配列が scikit-learn に渡り、
+        # 欠損値の確認で失敗するため、書き込み可能な配列のまま学習する（列名は保存の前に設定する）
+        sub_forest.fit(X_chunk, y_fit, sample_weight=sample_weight)
+
+        # サブフォレストの木を1つのフォレストにまとめる
+        if forest is None:
+            forest = sub_forest
+        else:
+            forest.estimators_.extend(sub_forest.estimators_)
+        del X_chunk, y_chunk, y_fit, sample_weight, sub_forest
+        gc.collect()
+
+        print(f"チャンク {i + 1}: {n_real - is_eval.sum()}件で{trees_per_chunk}本を学習 "
+              f"(合計{len(forest.estimators_)}本) / ピークメモリ {peak_rss_mb():.0f}MB")
+        if peak_rss_mb() > memory_limit_mb:
+            print(f"警告: ピークメモリがメモリ上限 {memory_limit_mb}MB を超えました。--chunk-rows を小さくしてください。")
+
+    forest.n_estimators = len(forest.estimators_)
+    print("モデルの学習が完了しました。")
+
+    # 4. 全チャンクから取り分けた評価用の行で評価
+    print("\n--- 4. モデルの性能評価 ---")
+    X_eval, y_eval, _ = reservoir
+    y_pred = forest.predict(X_eval)
+    print(f"評価データ ({len(y_eval)}件) に対する正解率 (Accuracy): {accuracy_score(y_eval, y_pred):.4f}")
+
+    # 予測スクリプトは feature_names_in_ で出馬表の列を学習時の順番に揃えるため、列名を設定しておく
+    forest.feature_names_in_ = np.asarray(feature_columns, dtype=object)
+
+    # 5. モデルとエンコーダーの保存
+    print("\n--- 5. 学習済みモデルとエンコーダーの保存 ---")
+    joblib.dump(forest, MODEL_PATH)
+    joblib.dump(encoders, ENCODERS_PATH)
+    print(f"'{MODEL_PATH}' と '{ENCODERS_PATH}' を保存しました。")
+    print(f"学習全体のピークメモリ: {peak_rss_mb():.0f}MB (上限 {memory_limit_mb}MB)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="メモリに載りきらないデータセットから、チャンクごとにランダムフォレストを学習します。")
+    parser.add_argument('csv_file', nargs='?', default='cleaned_race_data.csv',
+                        help="データセットのCSVファイル（デフォルト: cleaned_race_data.csv）")
+    parser.add_argument('--memory-limit-mb', type=int, default=1024, help="メモリ使用量の上限(MB、デフォルト: 1024)")
+    parser.add_argument('--trees-per-chunk', type=int, default=10, help="1チャンクあたりの木の本数（デフォルト: 10）")
+    parser.add_argument('--chunk-rows', type=int, default=None, help="1チャンクの行数（省略時はメモリ上限から決める）")
+    args = parser.parse_args()
+
+    train_out_of_core(args.csv_file, memory_limit_mb=args.memory_limit_mb,
+                      trees_per_chunk=args.trees_per_chunk, chunk_rows=args.chunk_rows)
@@ -0,0 +1,325 @@
+import pandas as pd
+import numpy as np
+from sklearn.metrics import accuracy_score, log_loss
+from multiprocessing import get_context, shared_memory, TimeoutError as PoolTimeoutError
+from threadpoolctl import threadpool_limits
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+
+from train_model import (
+    TUNED_PARAMS_PATH, CATEGORICAL_COLS, ESTIMATOR_BACKENDS, load_training_data, split_feature_matrix,
+)
+
+# 評価結果を1件ずつ追記するログ（中断しても、同じ条件で再実行すれば評価済みの候補は再利用される）
+TUNING_LOG_PATH = 'tuning_results.jsonl'
+# 候補の評価に使う検証データの最大行数
+EVAL_ROWS = 50_000
+# 最初の段階で学習に使う最小の行数
+MIN_TRAIN_ROWS = 5_000
+
+# モデルごとの探索範囲
+# resource は段階が進むごとに増やすパラメータ（木の本数・ブースティング回数）、max_resource は最終段階での値
+SEARCH_SPACES = {
+    'random_forest': {
+        'resource': 'n_estimators',
+        'min_resource': 5,
+        'max_resource': 100,
+        'params': {
+            'max_depth': [None, 12, 20, 30],
+            'min_samples_leaf': [1, 5, 20, 50],
+            'max_features': ['sqrt', 0.3, 0.6],
+        },
+    },
+    'hist_gradient_boosting': {
+        'resource': 'max_iter',
+        'min_resource': 20,
+        'max_resource': 300,
+        'params': {
+            'learning_rate': [0.03, 0.1, 0.3],
+            'max_leaf_nodes': [15, 31, 63],
+            'min_samples_leaf': [20, 50, 200],
+            'l2_regularization': [0.0, 1.0],
+        },
+    },
+}
+
+# ワーカープロセスが共有メモリから作った配列と、評価に必要な情報（_attach_shared_data で設定する）
+_shared = {}
+
+
+def dataset_signature(file_path):
+    """データセットのファイルを識別する文字列（ファイルが更新されるとログの評価結果を再利用しない）"""
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def sample_candidates(space, n_candidates, random_state=42):
+    """
+    探索範囲の全組み合わせから候補を無作為に選ぶ関数
+    乱数を固定しているため、再実行しても同じ候補が選ばれる（ログの再利用に必要）
+
+    Returns:
+        list: ハイパーパラメータの辞書のリスト
+    """
+    names = list(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*space.values())]
+    rng = np.random.RandomState(random_state)
+    chosen = rng.choice(len(grid), size=min(n_candidates, len(grid)), replace=False)
+    return [grid[i] for i in chosen]
+
+
+def load_tuning_log(log_path):
+    """
+    これまでの評価結果をログから読み込む関数
+
+    Returns:
+        dict: result_key をキー、評価結果の辞書を値とする辞書
+    """
+    results = {}
+    try:
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[record['key']] = record
+    except FileNotFoundError:
+        pass
+    return results
+
+
+def result_key(dataset, backend, params, n_rows, resource):
+    """評価条件（データセット・モデル・ハイパーパラメータ・行数・木の本数）を表すログのキー"""
+    return json.dumps([dataset, backend, params, n_rows, resource], sort_keys=True, ensure_ascii=False)
+
+
+def _create_shared_array(shape, dtype, blocks):
+    """共有メモリ上に配列を確保し、ワーカーが接続するための情報を返す"""
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, math.prod(shape) * dtype.itemsize))
+    blocks.append(block)
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return array, (block.name, shape, dtype.str)
+
+
+def _attach_shared_data(spec):
+    """
+    ワーカープロセスの初期化関数
+    親プロセスが作った共有メモリに名前で接続し、データをコピーせずに配列として参照する
+    """
+    # 候補ごとにプロセスを分けて並列化するため、各プロセス内のスレッドは1つに抑える
+    threadpool_limits(limits=1)
+    blocks = []
+    for key, (name, shape, dtype) in spec['arrays'].items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        _shared[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    _shared['blocks'] = blocks
+    _shared.update({key: value for key, value in spec.items() if key != 'arrays'})
+
+
+def _evaluate_candidate(task):
+    """
+    ワーカープロセスの中で1つの候補を学習し、検証データの損失を返す関数
+    学習データは共有メモリ上の訓練データの先頭 n_rows 行（分割時に行がシャッフル済みのため無作為抽出になる）
+    """
+    features, target = _shared['features'], _shared['target']
+    n_train, n_eval = _shared['n_train'], _shared['n_eval']
+    columns = _shared['feature_names']
+    X_fit = pd.DataFrame(features[:task['n_rows']], columns=columns, copy=False)
+    X_eval = pd.DataFrame(features[n_train:n_train + n_eval], columns=columns, copy=False)
+    y_eval = target[n_train:n_train + n_eval]
+
+    model = ESTIMATOR_BACKENDS[_shared['backend']]['build'](_shared['categorical_cols'])
+    model.set_params(**task['params'], **{_shared['resource']: task['resource']})
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+
+    fit_started_at = time.perf_counter()
+    model.fit(X_fit, target[:task['n_rows']])
+    fit_seconds = time.perf_counter() - fit_started_at
+
+    # 学習データの先頭に無かった着順の列は確率0として、全クラスの確率表に揃える
+    classes = _shared['classes']
+    proba = np.zeros((len(X_eval), len(classes)))
+    proba[:, np.searchsorted(classes, model.classes_)] = model.predict_proba(X_eval)
+    return {
+        **task,
+        'log_loss': log_loss(y_eval, proba, labels=classes),
+        'accuracy': accuracy_score(y_eval, classes[proba.argmax(axis=1)]),
+        'fit_seconds': fit_seconds,
+    }
+
+
+def save_tuned_params(backend, params, params_path=TUNED_PARAMS_PATH):
+    """最良のハイパーパラメータを、他のモデルの設定を残したまま学習時の既定値として保存する"""
+    try:
+        with open(params_path, encoding='utf-8') as f:
+            tuned = json.load(f)
+    except FileNotFoundError:
+        tuned = {}
+    tuned[backend] = params
+    with open(params_path, 'w', encoding='utf-8') as f:
+        json.dump(tuned, f, ensure_ascii=False, indent=2)
+
+
+def tune_hyperparameters(file_path, backend='random_forest', n_candidates=27, eta=3, budget_minutes=60,
+                         workers=None, max_resource=None, log_path=TUNING_LOG_PATH, params_path=TUNED_PARAMS_PATH):
+    """
+    逐次半減法（successive halving）でハイパーパラメータを探索し、最良の設定を学習時の既定値として保存する関数
+    全候補を少ない行数・少ない木の本数で評価し、損失の小さい 1/eta だけを残して行数と木の本数を eta 倍に増やす
+
+    Args:
+        file_path (str): データセットのCSVファイルへのパス
+        backend (str): 探索するモデル（SEARCH_SPACES のキー）
+        n_candidates (int): 最初の段階で評価する候補の数
+        eta (int): 各段階で残す候補の割合の逆数（行数・木の本数の増加率）
+        budget_minutes (float): 探索全体の制限時間（分）。超えた時点で評価中の候補を打ち切る
+        workers (int): 並列に評価するプロセス数。Noneの場合はCPU数
+        max_resource (int): 最終段階の木の本数（ブースティング回数）。Noneの場合は SEARCH_SPACES の値
+        log_path (str): 評価結果のログのパス
+        params_path (str): 最良のハイパーパラメータの保存先
+    """
+    deadline = time.monotonic() + budget_minutes * 60
+    search_space = SEARCH_SPACES[backend]
+    max_resource = max_resource or search_space['max_resource']
+    training_data = load_training_data(file_path, native_categorical=ESTIMATOR_BACKENDS[backend]['native_categorical'])
+    if training_data is None:
+        return
+    X, y, _ = training_data
+    dataset = dataset_signature(file_path)
+
+    # 4. 特徴量と着順を共有メモリ上の配列に直接書き込む（ワーカーには共有メモリの名前だけを渡す）
+    print("\n--- 4. データの分割と共有メモリへの配置 ---")
+    blocks = []
+    pool = None
+    try:
+        features, features_spec = _create_shared_array(X.shape, np.float32, blocks)
+        target, target_spec = _create_shared_array((len(y),), y.dtype, blocks)
+        X_train, X_test, y_train, y_test, _ = split_feature_matrix(X, y, out=features)
+        n_train = len(X_train)
+        target[:n_train], target[n_train:] = y_train, y_test
+        feature_names = list(X.columns)
+        # 共有メモリを参照するデータフレームが残っていると、終了時に共有メモリを閉じられないため解放する
+        del X, y, X_train, X_test, y_train, y_test
+        print(f"訓練データ: {n_train}件, 検証データ: {min(EVAL_ROWS, len(target) - n_train)}件 "
+              f"(共有メモリ {features.nbytes / 1024 / 1024:.0f}MB)")
+
+        spec = {
+            'arrays': {'features': features_spec, 'target': target_spec},
+            'n_train': n_train,
+            'n_eval': min(EVAL_ROWS, len(target) - n_train),
+            'feature_names': feature_names,
+            'categorical_cols': [col for col in CATEGORICAL_COLS if col in feature_names],
+            'classes': np.unique(target),
+            'backend': backend,
+            'resource': search_space['resource'],
+        }
+
+        # 5. 逐次半減法による探索
+        candidates = sample_candidates(search_space['params'], n_candidates)
+        n_rungs = int(math.log(len(candidates)) / math.log(eta) + 1e-9) + 1
+        workers = workers or os.cpu_count() or 1
+        logged = load_tuning_log(log_path)
+        print(f"\n--- 5. ハイパーパラメータの探索 ({backend}: 候補{len(candidates)}個, {n_rungs}段階, "
+              f"{workers}プロセス, 制限時間{budget_minutes}分) ---")
+
+        pool = get_context('spawn').Pool(workers, initializer=_attach_shared_data, initargs=(spec,))
+        survivors = candidates
+        rung_results = []
+        budget_exhausted = False
+        for rung in range(n_rungs):
+            scale = eta ** (n_rungs - 1 - rung)
+            n_rows = min(n_train, max(MIN_TRAIN_ROWS, n_train // scale))
+            resource = max(search_space['min_resource'], max_resource // scale)
+            tasks = [{'params': params, 'n_rows': n_rows, 'resource': resource} for params in survivors]
+
+            results = []
+            pending = []
+            for task in tasks:
+                key = result_key(dataset, backend, task['params'], n_rows, resource)
+                if key in logged:
+                    results.append(logged[key])
+                else:
+                    pending.append(task)
+            print(f"\n[{rung + 1}段階目] 候補{len(tasks)}個 / {n_rows}行 / {search_space['resource']}={resource} "
+                  f"(ログから再利用: {len(tasks) - len(pending)}個)")
+
+            if pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    budget_exhausted = True
+                    break
+                iterator = pool.imap_unordered(_evaluate_candidate, pending)
+                with open(log_path, 'a', encoding='utf-8') as log_file:
+                    for _ in pending:
+                        try:
+                            result = iterator.next(timeout=max(0.0, deadline - time.monotonic()))
+                        except PoolTimeoutError:
+                            budget_exhausted = True
+                            break
+                        result['key'] = result_key(dataset, backend, result['params'], n_rows, resource)
+                        log_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                        log_file.flush()
+                        results.append(result)
+                        print(f"  log_loss {result['log_loss']:.4f} / 正解率 {result['accuracy']:.4f} / "
+                              f"学習 {result['fit_seconds']:.1f}秒 / {result['params']}")
+
+            if results:
+                rung_results = sorted(results, key=lambda r: r['log_loss'])
+            if budget_exhausted:
+                break
+            survivors = [r['params'] for r in rung_results[:max(1, len(rung_results) // eta)]]
+
+        if budget_exhausted:
+            # 評価中のワーカーを止める（完了した評価はログに残っているため、再実行すると続きから探索する）
+            pool.terminate()
+            print(f"\n制限時間 ({budget_minutes}分) に達したため、探索を打ち切りました。")
+        if not rung_results:
+            print("評価が完了した候補がないため、ハイパーパラメータは保存しません。")
+            return
+
+        # 6. 最も進んだ段階で損失が最小の候補を保存（木の本数は最終段階の値にする）
+        print("\n--- 6. 探索結果 ---")
+        pd.options.display.float_format = '{:.4f}'.format
+        summary = pd.DataFrame([
+            {**r['params'], '行数': r['n_rows'], search_space['resource']: r['resource'],
+             'log_loss': r['log_loss'], '正解率': r['accuracy'], '学習時間(秒)': r['fit_seconds']}
+            for r in rung_results
+        ])
+        print(summary.to_string(index=False))
+
+        best_params = {**rung_results[0]['params'], search_space['resource']: max_resource}
+        save_tuned_params(backend, best_params, params_path)
+        print(f"\n最良のハイパーパラメータ: {best_params}")
+        print(f"'{params_path}' に保存しました。train_model.py はこの設定で学習します。")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        # 共有メモリ上の配列への参照を外してから閉じる
+        features = target = None
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="逐次半減法でモデルのハイパーパラメータを探索し、最良の設定を学習時の既定値にします。")
+    parser.add_argument('csv_file', nargs='?', default='cleaned_race_data.csv',
+                        help="データセットのCSVファイル（デフォルト: cleaned_race_data.csv）")
+    parser.add_argument('--backend', choices=list(SEARCH_SPACES), default='random_forest',
+                        help="探索するモデル（デフォルト: random_forest）")
+    parser.add_argument('--candidates', type=int, default=27, help="最初の段階で評価する候補の数（デフォルト: 27）")
+    parser.add_argument('--eta', type=int, default=3, help="各段階で残す候補の割合の逆数（デフォルト: 3）")
+    parser.add_argument('--budget-minutes', type=float, default=60, help="探索全体の制限時間（分、デフォルト: 60）")
+    parser.add_argument('--workers', type=int, default=None, help="並列に評価するプロセス数（省略時はCPU数）")
+    parser.add_argument('--max-trees', type=int, default=None,
+                        help="最終段階の木の本数（ブースティング回数）。省略時はモデルごとの既定値")
+    args = parser.parse_args()
+
+    tune_hyperparameters(args.csv_file, backend=args.backend, n_candidates=args.candidates, eta=args.eta,
+                         budget_minutes=args.budget_minutes, workers=args.workers, max_resource=args.max_trees)